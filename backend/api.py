@@ -0,0 +1,451 @@
+"""Streamlit に依存しない JSON API（ASGI）。
+
+app.py と同じ部品（ルーター・処方キャッシュ・採点エンジン・マッチャー・コミュニティストア）を
+HTTP から使えるようにする。リクエストをまたぐ状態は持たず、投稿やレート制限・利用量の台帳は
+共有の SQLite に置くので、ワーカーを増やすだけでスケールする（プロセス内の処方キャッシュは
+ワーカーごとの使い回しで、無くても結果は変わらない）。上流への同時リクエスト数
+（LLM_MAX_CONCURRENCY）と同じリクエストの相乗り（LLM_COALESCE_TIMEOUT）も app.py と同じく
+ワーカーごとに効かせる。
+
+    python api.py --workers 4 --port 8000
+    uvicorn api:app --workers 4 --port 8000 --proxy-headers
+
+エンドポイント:
+    GET  /api/health
+    GET  /api/questions                         診断の質問と選択肢（配点は返さない）
+    POST /api/score        {"answers": {...}}   採点結果とマッチしたキャラクター
+    POST /api/match        {"profile": {...}} または {"mbti": "INFP"}
+    POST /api/prescription {"mbti": "INFP"}     Shadow Book の処方（personality でも可）
+    GET  /api/feed?mbti=&symptom=&cursor=&limit=
+    POST /api/feed         {"mbti", "title", "symptom", "effect"}
+
+frontend/dist がビルド済みなら / で React のフロントエンドも配信する。
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import startup
+
+startup.load_env()
+
+import metrics
+from async_llm import request_key
+from community_store import CommunityStore, Post
+from groq_client import CircuitOpenError
+from master_data import AXES, get_master_data
+from model_router import get_router
+from prescription_cache import PrescriptionCache, make_key
+from prescription_store import PrescriptionStore
+from prompts import SYSTEM_PROMPT, TEMPERATURE, build_messages, build_user_prompt, completion_options, mbti_shadow_map
+from rate_limiter import QuotaExceeded, RateLimitTimeout
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "frontend", "dist")
+FEED_PAGE_SIZE = 20
+MAX_FEED_PAGE_SIZE = 100
+# 事前生成の処方を読み直す間隔（app.py の cache_resource(ttl=600) と同じ）
+PRESCRIPTION_STORE_TTL = 600
+
+# uvicorn が設定するロガーに出す（例外の詳細はログにだけ残し、レスポンスには出さない）
+log = logging.getLogger("uvicorn.error")
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers
+
+
+# --- ワーカープロセスごとの共有リソース ---
+_resources = {}
+_resources_lock = threading.Lock()
+
+
+def _shared(name, factory, ttl=None):
+    """name ごとに factory() の結果を使い回す。ttl 秒を過ぎたら作り直す"""
+    entry = _resources.get(name)
+    if entry is None or (ttl is not None and time.monotonic() - entry[1] > ttl):
+        with _resources_lock:
+            entry = _resources.get(name)
+            if entry is None or (ttl is not None and time.monotonic() - entry[1] > ttl):
+                entry = _resources[name] = (factory(), time.monotonic())
+    return entry[0]
+
+
+def get_prescription_cache():
+    return _shared("prescription_cache", lambda: PrescriptionCache(
+        max_entries=int(os.getenv("PRESCRIPTION_CACHE_SIZE", "256")),
+        ttl_seconds=int(os.getenv("PRESCRIPTION_CACHE_TTL", str(24 * 60 * 60))),
+        variety=int(os.getenv("PRESCRIPTION_CACHE_VARIETY", "1")),
+    ))
+
+
+def get_prescription_store():
+    return _shared("prescription_store", lambda: PrescriptionStore.load(
+        system_prompt=SYSTEM_PROMPT,
+        max_age=int(os.getenv("PRESCRIPTION_STORE_MAX_AGE", str(7 * 24 * 60 * 60))),
+    ), ttl=PRESCRIPTION_STORE_TTL)
+
+
+def _create_community_store():
+    store = CommunityStore()
+    store.seed_if_empty()
+    return store
+
+
+def get_community_store():
+    return _shared("community_store", _create_community_store)
+
+
+# --- 入出力 ---
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ApiError(400, "JSON の本文が必要です") from None
+    if not isinstance(body, dict):
+        raise ApiError(400, "JSON オブジェクトを送ってください")
+    return body
+
+
+def _mbti(value, field="mbti"):
+    if not isinstance(value, str) or value not in mbti_shadow_map:
+        raise ApiError(400, f"不明なMBTIタイプです: {value!r}（{field}）")
+    return value
+
+
+def _request_mbti(body):
+    """mbti、または既存の React フロントエンドが送る personality（文字列か {"mbti": ...}）から MBTI を取る"""
+    if body.get("mbti") is not None:
+        return _mbti(body["mbti"])
+    personality = body.get("personality")
+    if isinstance(personality, dict):
+        return _mbti(personality.get("mbti"), "personality.mbti")
+    return _mbti(personality, "personality")
+
+
+def _text(body, field, default=""):
+    value = body.get(field)
+    if value is None:
+        return default
+    if not isinstance(value, str):
+        raise ApiError(400, f"{field} は文字列で指定してください")
+    return value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _caller(request):
+    """レート制限と台帳で使う呼び出し元。ロードバランサー越しなら --proxy-headers で実 IP になる"""
+    return f"ip:{request.client.host}" if request.client is not None else "ip:unknown"
+
+
+def _character_json(character):
+    return {
+        "id": character.id,
+        "name": character.name,
+        "catchphrase": character.catchphrase,
+        "image_prompt": character.image_prompt,
+        "matching_logic": [{"axis": axis, "pole": pole} for axis, pole in character.matching_logic],
+        "chat_config": character.chat_config._asdict(),
+    }
+
+
+def _post_json(post):
+    return dataclasses.asdict(post)
+
+
+# --- エンドポイント ---
+async def health(request):
+    return JSONResponse({"status": "ok"})
+
+
+def questions(request):
+    return JSONResponse({
+        "axes": list(AXES),
+        "questions": [
+            {
+                "id": q.id,
+                "type": q.type,
+                "question": q.question,
+                "asset_prompt": q.asset_prompt,
+                "choices": [{"key": c.key, "label": c.label, "asset_prompt": c.asset_prompt} for c in q.choices],
+            }
+            for q in get_master_data().questions
+        ],
+    })
+
+
+async def score(request):
+    answers = (await _json_body(request)).get("answers")
+    if not isinstance(answers, dict) or not all(isinstance(v, str) for v in answers.values()):
+        raise ApiError(400, "answers に {質問ID: 選択肢キー} を指定してください")
+    return JSONResponse(await asyncio.to_thread(_score, answers))
+
+
+def _score(answers):
+    from matcher import get_matcher
+    from scoring import get_engine
+
+    try:
+        result = get_engine().score(answers)
+    except ValueError as e:
+        raise ApiError(400, str(e)) from None
+    result["character"] = _character_json(get_matcher().match(result["profile"]))
+    return result
+
+
+async def match(request):
+    body = await _json_body(request)
+    if "profile" in body:
+        profile = body["profile"]
+        if not isinstance(profile, dict) or not all(_is_number(profile.get(axis, 0)) for axis in AXES):
+            raise ApiError(400, f"profile に {{{', '.join(AXES)}: 数値}} を指定してください")
+    else:
+        from book_catalog import axes_from_mbti
+
+        profile = dict(zip(AXES, (float(v) for v in axes_from_mbti(_mbti(body.get("mbti"))))))
+    return JSONResponse(await asyncio.to_thread(_match, profile))
+
+
+def _match(profile):
+    from matcher import get_matcher
+
+    return {"profile": profile, "character": _character_json(get_matcher().match(profile))}
+
+
+async def prescription(request):
+    body = await _json_body(request)
+    mbti = _request_mbti(body)
+    shadow_mbti = mbti_shadow_map[mbti]
+    router = get_router()
+    started = time.perf_counter()
+
+    def lookup():
+        from book_catalog import pick_shadow_book
+
+        # app.py と同じく、カタログから本を先に選び 事前生成 → キャッシュ の順に探す
+        book = pick_shadow_book(mbti)
+        user_prompt = build_user_prompt(mbti, book)
+        stored = get_prescription_store().lookup(mbti, user_prompt)
+        if stored is not None:
+            return book, user_prompt, "store", stored['model'], stored['content']
+        model = router.pick("prescription")
+        return book, user_prompt, "cache", model, get_prescription_cache().get(
+            make_key(SYSTEM_PROMPT, user_prompt, model, TEMPERATURE))
+
+    book, user_prompt, source, model, content = await asyncio.to_thread(lookup)
+    metrics.CACHE_LOOKUPS.inc(source=source if content is not None else "live")
+    if content is None:
+        source = "live"
+        try:
+            content, model = await _shared_generation(
+                request.app.state, router, user_prompt,
+                messages=build_messages(user_prompt), user=_caller(request), **completion_options(book))
+        except (RateLimitTimeout, QuotaExceeded):
+            raise
+        except Exception as e:
+            raise _upstream_error(e) from e
+    return JSONResponse({
+        "mbti": mbti,
+        "personality": mbti,
+        "shadow_type": shadow_mbti,
+        "book": book.title if book is not None else None,
+        "author": book.author if book is not None else None,
+        "reason": content,
+        "content": content,
+        "source": source,
+        "model": model,
+        "total_ms": (time.perf_counter() - started) * 1000,
+    })
+
+
+async def _generate(state, router, user_prompt, kwargs):
+    # async_llm と同じく、レート制限の順番待ちは同時実行数の枠の外で行う
+    reservation = await router.areserve(**kwargs)
+    try:
+        await state.llm_slots.acquire()
+    except BaseException:
+        await router.arelease(reservation)
+        raise
+    try:
+        completion, model = await router.acomplete("prescription", reservation=reservation, **kwargs)
+    finally:
+        state.llm_slots.release()
+    content = completion.choices[0].message.content
+    # 呼び出し元が切断しても、生成できた処方はキャッシュに残す
+    get_prescription_cache().put(make_key(SYSTEM_PROMPT, user_prompt, model, TEMPERATURE), content)
+    return content, model
+
+
+async def _shared_generation(state, router, user_prompt, **kwargs):
+    """同じ処方が生成中ならその結果を待ち、無ければ生成する。(content, model) を返す"""
+    if state.coalesce_timeout <= 0:
+        return await _generate(state, router, user_prompt, kwargs)
+    key = request_key("prescription", kwargs)
+    now = time.perf_counter()
+    shared = state.inflight.get(key)
+    if shared is not None and not shared[1].done() and now - shared[0] < state.coalesce_timeout:
+        metrics.LLM_COALESCED.inc(request_class="prescription")
+        task = shared[1]
+    else:
+        task = asyncio.ensure_future(_generate(state, router, user_prompt, kwargs))
+        state.inflight[key] = (now, task)
+
+        def forget(done):
+            if state.inflight.get(key, (None, None))[1] is task:
+                del state.inflight[key]
+            if not done.cancelled():
+                # 待っていた全員が切断したときに「取り出されなかった例外」の警告を出さない
+                done.exception()
+
+        task.add_done_callback(forget)
+    # 1人が切断しても、相乗りしている他のリクエストの生成は止めない
+    return await asyncio.shield(task)
+
+
+def feed(request):
+    params = request.query_params
+    try:
+        limit = min(MAX_FEED_PAGE_SIZE, max(1, int(params.get("limit", FEED_PAGE_SIZE))))
+        cursor = int(params["cursor"]) if params.get("cursor") else None
+    except ValueError:
+        raise ApiError(400, "limit と cursor は整数で指定してください") from None
+    mbti = params.get("mbti") or None
+    symptom = params.get("symptom") or None
+    store = get_community_store()
+    posts, next_cursor = store.page(limit=limit, before_id=cursor, mbti=mbti, symptom=symptom)
+    return JSONResponse({
+        "posts": [_post_json(p) for p in posts],
+        "next_cursor": next_cursor,
+        "total": store.count(mbti=mbti, symptom=symptom),
+    })
+
+
+async def create_post(request):
+    body = await _json_body(request)
+    try:
+        post = Post(
+            mbti=_text(body, "mbti"),
+            title=_text(body, "title"),
+            symptom=_text(body, "symptom"),
+            effect=_text(body, "effect"),
+            # 保存される値と同じものを返す（add は created_at があればそれを使う）
+            created_at=time.time(),
+        )
+    except ValueError as e:
+        raise ApiError(400, str(e)) from None
+    post_id = await asyncio.to_thread(get_community_store().add, post)
+    return JSONResponse(_post_json(dataclasses.replace(post, id=post_id)), status_code=201)
+
+
+# --- エラー ---
+def _upstream_error(error):
+    """Groq 側の失敗を、詳細をログに残したうえで一般的な 502 / 503 に変える"""
+    import groq
+
+    log.warning("prescription upstream error: %r", error)
+    if isinstance(error, (CircuitOpenError, groq.APIConnectionError)):
+        # APITimeoutError も APIConnectionError の一種
+        return ApiError(503, "AI が一時的に利用できません。しばらくしてから再試行してください", {"Retry-After": "30"})
+    return ApiError(502, "AI の応答を取得できませんでした。しばらくしてから再試行してください")
+
+
+async def _api_error(request, exc):
+    return JSONResponse({"error": str(exc)}, status_code=exc.status, headers=exc.headers)
+
+
+async def _rate_limited(request, exc):
+    # 混雑で待ちきれなかった。少し置いてから再試行してもらう
+    return JSONResponse({"error": str(exc)}, status_code=503, headers={"Retry-After": "5"})
+
+
+async def _quota_exceeded(request, exc):
+    return JSONResponse({"error": str(exc)}, status_code=429)
+
+
+async def _server_error(request, exc):
+    log.error("unhandled error on %s %s", request.method, request.url.path, exc_info=exc)
+    return JSONResponse({"error": "エラーが発生しました"}, status_code=500)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # METRICS_PORT は最初に起動したワーカーだけが受け持つ（他はポートの使用中で諦める）。
+    # 全ワーカーの値は METRICS_DUMP_PATH のワーカーごとのファイルで見る
+    metrics.start_exporters()
+    # モデルのプローブは最初のリクエストを待たずにワーカーの起動時に始める
+    get_router()
+    # 上流の同時リクエスト数の枠と、生成中の処方（request_key → (開始時刻, Task)）。
+    # どちらもこのワーカーのイベントループ上だけで使う
+    app.state.llm_slots = asyncio.Semaphore(int(os.getenv("LLM_MAX_CONCURRENCY", "8")))
+    app.state.coalesce_timeout = float(os.getenv("LLM_COALESCE_TIMEOUT", "30"))
+    app.state.inflight = {}
+    yield
+
+
+def create_app(static_dir=None):
+    static_dir = static_dir or os.getenv("API_STATIC_DIR", STATIC_DIR)
+    routes = [
+        Route("/api/health", health),
+        Route("/api/questions", questions),
+        Route("/api/score", score, methods=["POST"]),
+        Route("/api/match", match, methods=["POST"]),
+        Route("/api/prescription", prescription, methods=["POST"]),
+        Route("/api/feed", feed, methods=["GET"]),
+        Route("/api/feed", create_post, methods=["POST"]),
+    ]
+    if os.path.isdir(static_dir):
+        from starlette.staticfiles import StaticFiles
+
+        routes.append(Mount("/", StaticFiles(directory=static_dir, html=True)))
+    origins = [o.strip() for o in os.getenv("API_CORS_ORIGINS", "*").split(",") if o.strip()]
+    return Starlette(
+        routes=routes,
+        middleware=[Middleware(CORSMiddleware, allow_origins=origins, allow_methods=["GET", "POST"],
+                               allow_headers=["Content-Type"])],
+        exception_handlers={
+            ApiError: _api_error,
+            RateLimitTimeout: _rate_limited,
+            QuotaExceeded: _quota_exceeded,
+            Exception: _server_error,
+        },
+        lifespan=lifespan,
+    )
+
+
+app = create_app()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shadow Books の JSON API を起動する")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("API_WORKERS", "1")),
+                        help="ワーカープロセス数（コア数まで増やせる）")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    uvicorn.run("api:app", host=args.host, port=args.port, workers=args.workers, proxy_headers=True,
+                app_dir=os.path.dirname(os.path.abspath(__file__)))
+
+
+if __name__ == "__main__":
+    main()
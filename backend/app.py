@@ -1,55 +1,145 @@
 
+import startup
+startup.begin()
+
 import streamlit as st
-from groq import Groq
-import plotly.graph_objects as go
 import datetime
 import os
-from dotenv import load_dotenv
+import time
+import uuid
+import async_llm
+import chat_engine
+import metrics
+from model_router import get_router
+from community_store import CommunityStore, Post
+from master_data import AXES, get_master_data
+from prescription_cache import PrescriptionCache, make_key
+from prescription_store import PrescriptionStore
+from rate_limiter import QuotaExceeded, RateLimitTimeout
+from prompts import SYSTEM_PROMPT, TEMPERATURE, build_messages, build_user_prompt, build_worry_prompt, completion_options, mbti_shadow_map
+from search_index import CommunitySearch
+from user_store import LoginRateLimited, UserStore
+# 本のカタログ（numpy）・レーダーチャート（plotly）・意味的キャッシュ（numpy）と groq は、
+# 初回の描画を軽くするため使う場所で読み込む
 
-# 環境変数を読み込む
-load_dotenv()
+# 環境変数を読み込む（.env があるときだけ）
+startup.load_env()
+startup.mark("imports")
 
 # --- ページ設定 ---
 st.set_page_config(page_title="Shadow Books AI", layout="wide", page_icon="🌓")
 
-# --- API設定 ---
-client = Groq(
-    api_key=os.getenv("GROQ_API_KEY")
-)
-
-# --- システムプロンプト ---
-SYSTEM_PROMPT = """
-あなたは「熟練の選書カウンセラー（Book Therapist）」です。
-ユーザーのMBTI（性格）と真逆の性質を持つ本（Shadow Book）を提案し、
-なぜその本がユーザーの「影」を補い、成長させるのかを解説してください。
-"""
-
-# --- データ定義: MBTIとShadow ---
-mbti_shadow_map = {
-    "INTJ": "ESFP", "INTP": "ESFJ", "ENTJ": "ISFP", "ENTP": "ISFJ",
-    "INFJ": "ESTP", "INFP": "ESTJ", "ENFJ": "ISTP", "ENFP": "ISTJ",
-    "ISTJ": "ENFP", "ISFJ": "ENTP", "ESTJ": "INFP", "ESFJ": "INTP",
-    "ISTP": "ENFJ", "ISFP": "ENTJ", "ESTP": "INFJ", "ESFP": "INTJ"
-}
-
-
-# --- 仮ユーザー管理・セッション初期化 ---
-if 'users' not in st.session_state:
-    st.session_state['users'] = {
-        'testuser': {'password': 'testpass', 'mbti': 'INFP'}
-    }
-if 'user' not in st.session_state:
-    st.session_state['user'] = None  # None=ゲスト, dict={'username':..., 'mbti':...}
+# --- API設定（プロセス共有のクライアントとモデルルーターを使い回す） ---
+router = get_router()
+# METRICS_PORT / METRICS_DUMP_PATH が設定されていれば計測値を外に出す
+metrics.start_exporters()
+
+# --- 処方キャッシュ（全セッション共有） ---
+@st.cache_resource
+def get_prescription_cache():
+    return PrescriptionCache(
+        max_entries=int(os.getenv("PRESCRIPTION_CACHE_SIZE", "256")),
+        ttl_seconds=int(os.getenv("PRESCRIPTION_CACHE_TTL", str(24 * 60 * 60))),
+        variety=int(os.getenv("PRESCRIPTION_CACHE_VARIETY", "1")),
+    )
+
+prescription_cache = get_prescription_cache()
+
+# --- 自由入力の悩みへの回答キャッシュ（言い回しが違うだけの相談にも使い回す） ---
+@st.cache_resource
+def get_semantic_cache():
+    from semantic_cache import SemanticCache
+
+    return SemanticCache(
+        max_entries=int(os.getenv("SEMANTIC_CACHE_SIZE", "512")),
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.88")),
+        ttl_seconds=int(os.getenv("SEMANTIC_CACHE_TTL", str(24 * 60 * 60))),
+    )
+
+
+# --- 事前生成済みの処方（warmup.py が書き出す。定期的に読み直す） ---
+@st.cache_resource(ttl=600)
+def get_prescription_store():
+    return PrescriptionStore.load(
+        system_prompt=SYSTEM_PROMPT,
+        max_age=int(os.getenv("PRESCRIPTION_STORE_MAX_AGE", str(7 * 24 * 60 * 60))),
+    )
+
+prescription_store = get_prescription_store()
+
+# --- みんなの処方箋（全セッション共有の SQLite） ---
+@st.cache_resource
+def get_community_store():
+    store = CommunityStore()
+    store.seed_if_empty()
+    return store
+
+community_store = get_community_store()
+
+# --- 悩み・投稿の検索インデックス（新しい投稿は検索時に差分で取り込む） ---
+@st.cache_resource
+def get_community_search():
+    return CommunitySearch(get_master_data().scenarios, community_store)
+
+community_search = get_community_search()
+
+# 0 にするとストリーミングせず、生成完了を待ってから表示する
+STREAMING = os.getenv("PRESCRIPTION_STREAMING", "1") != "0"
+
+
+def render_result(res):
+    """処方結果の枠と計測値を描画する"""
+    st.success("処方が完了しました")
+    with st.container(border=True):
+        st.markdown(f"### 📖 {res['shadow_type']}的視点の獲得")
+        st.markdown(res['content'])
+    if 'total_ms' in res:
+        source = {"store": "事前生成", "cache": "キャッシュ"}.get(res.get('source'), "AI生成")
+        st.caption(f"{source} ({res.get('model', '-')}) / 初回トークン {res['ttft_ms']:.0f} ms / 合計 {res['total_ms']:.0f} ms")
+
+
+# --- ユーザー管理（全セッション共有の SQLite） ---
+@st.cache_resource
+def get_user_store():
+    store = UserStore()
+    store.seed_if_empty()
+    return store
+
+user_store = get_user_store()
+startup.mark("resources")
+
+# --- セッション初期化 ---
+if 'session_token' not in st.session_state:
+    st.session_state['session_token'] = None
+# None=ゲスト, dict={'username':..., 'mbti':...}（トークンから毎回引き直す）
+st.session_state['user'] = user_store.session_user(st.session_state['session_token'])
 if 'login_error' not in st.session_state:
     st.session_state['login_error'] = ''
-if 'reviews' not in st.session_state:
-    st.session_state['reviews'] = [
-        {"user_mbti": "INFP", "book": "『夜と霧』", "symptom": "将来への不安", "efficacy": "どんな絶望でも精神の自由は奪えないと知り、呼吸が楽になった。", "date": "2024-03-10"},
-        {"user_mbti": "ENTJ", "book": "『HARD THINGS』", "symptom": "孤独な意思決定", "efficacy": "答えのない恐怖に耐えるのがリーダーだと肯定され、迷いが消えた。", "date": "2024-03-12"}
-    ]
+# レート制限の順番と利用量の台帳に使う、ゲストのセッションごとの ID
+if 'guest_id' not in st.session_state:
+    st.session_state['guest_id'] = uuid.uuid4().hex[:12]
 
-# --- サイドバー: 仮ログイン/新規登録フォーム ---
-with st.sidebar:
+
+def llm_user():
+    """LLM 呼び出しの主（ログイン中はユーザー名、ゲストはセッションごと）"""
+    user = st.session_state['user']
+    return user['username'] if user is not None else f"guest:{st.session_state['guest_id']}"
+
+
+def show_llm_error(target, e):
+    # 混雑や日次上限はこちらで止めたものなので、エラーではなく案内として出す
+    if isinstance(e, (RateLimitTimeout, QuotaExceeded)):
+        target.warning(str(e))
+    else:
+        target.error(f"エラーが発生しました: {e}")
+
+# ページは以下のフラグメントに分かれていて、ウィジェットを操作するとそのフラグメントだけが再実行される。
+# フラグメント間で共有するものは引数か session_state で明示的に渡す。
+
+
+# --- サイドバー: ログイン/新規登録フォーム ---
+@st.fragment
+def sidebar_auth(user_store):
     st.markdown('### 👤 ログイン / 新規登録')
     if st.session_state['user'] is None:
         tab_login, tab_signup = st.tabs(["ログイン", "新規登録"])
@@ -57,16 +147,19 @@ with st.sidebar:
             login_username = st.text_input("ユーザー名", key="login_username")
             login_password = st.text_input("パスワード", type="password", key="login_password")
             if st.button("ログイン", key="login_btn"):
-                users = st.session_state['users']
-                if login_username in users and users[login_username]['password'] == login_password:
-                    st.session_state['user'] = {
-                        'username': login_username,
-                        'mbti': users[login_username]['mbti']
-                    }
+                try:
+                    token = user_store.authenticate(login_username, login_password)
+                except LoginRateLimited as e:
+                    token = None
+                    st.session_state['login_error'] = str(e)
+                else:
+                    if token is None:
+                        st.session_state['login_error'] = 'ユーザー名またはパスワードが違います'
+                if token is not None:
+                    st.session_state['session_token'] = token
+                    st.session_state['user'] = user_store.session_user(token)
                     st.session_state['login_error'] = ''
                     st.success('ログインしました！')
-                else:
-                    st.session_state['login_error'] = 'ユーザー名またはパスワードが違います'
             if st.session_state['login_error']:
                 st.error(st.session_state['login_error'])
         with tab_signup:
@@ -74,22 +167,24 @@ with st.sidebar:
             signup_password = st.text_input("新しいパスワード", type="password", key="signup_password")
             signup_mbti = st.selectbox("あなたのMBTI", list(mbti_shadow_map.keys()), key="signup_mbti")
             if st.button("新規登録", key="signup_btn"):
-                users = st.session_state['users']
-                if signup_username in users:
-                    st.error("このユーザー名は既に使われています")
-                elif not signup_username or not signup_password:
-                    st.error("ユーザー名とパスワードを入力してください")
+                try:
+                    user_store.register(signup_username, signup_password, signup_mbti)
+                except ValueError as e:
+                    st.error(str(e))
                 else:
-                    users[signup_username] = {
-                        'password': signup_password,
-                        'mbti': signup_mbti
-                    }
                     st.success("登録完了！ログインしてください")
     else:
         st.success(f"ログイン中: {st.session_state['user']['username']}")
         if st.button("ログアウト"):
+            user_store.logout(st.session_state['session_token'])
+            st.session_state['session_token'] = None
             st.session_state['user'] = None
             st.session_state['login_error'] = ''
+            st.rerun(scope="fragment")
+
+
+with st.sidebar:
+    sidebar_auth(user_store)
 
 # ==========================================
 # メインコンテンツ: 選書機能
@@ -99,52 +194,113 @@ st.title("🌓 Shadow Books")
 st.markdown("あなたの「影（Shadow）」を補う一冊を処方します。")
 st.divider()
 
-col1, col2 = st.columns([1, 1.5], gap="large")
-
-with col1:
-    st.subheader("👤 Profile Diagnosis")
-    my_mbti = st.selectbox("あなたのMBTIタイプを選択", list(mbti_shadow_map.keys()))
-    shadow_mbti = mbti_shadow_map[my_mbti]
-    
-    st.info(f"あなたのShadow（影）は... **【 {shadow_mbti} 】** です。")
-    
-    if st.button("Shadow Bookを処方する", type="primary", use_container_width=True):
-        with st.spinner("AIが選書中..."):
-            try:
-                # Groq APIへのリクエスト
-                chat_completion = client.chat.completions.create(
-                    messages=[
-                        {"role": "system", "content": SYSTEM_PROMPT},
-                        {"role": "user", "content": f"私のMBTIは{my_mbti}です。真逆の{shadow_mbti}的な視点を得られる本を1冊紹介してください。"}
-                    ],
-                    model="llama-3.3-70b-versatile",
-                    temperature=0.7,
-                )
-                suggestion = chat_completion.choices[0].message.content
-                
-                # 結果を保存
+
+# 全体の再実行では別スレッドで動くので、ストリームの受信がこれより下の描画（コミュニティ欄など）を待たせない
+@st.fragment(parallel=True)
+def receive_job(prescription_cache):
+    """生成中の処方を流し込み、完了したら結果として保存する"""
+    pending = st.session_state.get('job')
+    if pending is None:
+        return
+    job = pending['job']
+    try:
+        with st.container(border=True), metrics.render_phase("prescription_stream"):
+            st.markdown(f"### 📖 {pending['shadow_type']}的視点の獲得")
+            if STREAMING:
+                # トークンが届いた順に枠内へ描画する
+                suggestion = st.write_stream(job.iter_text())
+            else:
+                with st.spinner("AIが選書中..."):
+                    suggestion = job.text()
+        # フェイルオーバーした場合は実際に使ったモデルで登録する
+        prescription_cache.put(make_key(SYSTEM_PROMPT, pending['user_prompt'], job.model, TEMPERATURE), suggestion)
+        st.session_state['result'] = {
+            "content": suggestion,
+            "shadow_type": pending['shadow_type'],
+            "source": "live",
+            "model": job.model,
+            "ttft_ms": job.ttft_ms if job.ttft_ms is not None else job.total_ms,
+            "total_ms": job.total_ms,
+        }
+        st.session_state.pop('job', None)
+        render_result(st.session_state['result'])
+    except Exception as e:
+        # 生成の失敗なのでジョブを捨てる。再実行による中断（Streamlit の RerunException などは
+        # Exception ではない）はここを通らずジョブが残り、次の実行で続きから受け取る
+        st.session_state.pop('job', None)
+        show_llm_error(st, e)
+
+
+@st.fragment
+def prescription_panel(router, prescription_cache):
+    # 事前生成の処方は ttl 付きのリソースなので、フラグメントの再実行ごとに取り直す
+    prescription_store = get_prescription_store()
+    col1, col2 = st.columns([1, 1.5], gap="large")
+
+    with col1, metrics.render_phase("prescription"):
+        st.subheader("👤 Profile Diagnosis")
+        # 「悩みから探す」の相談でも使うので key を付けて session_state から読めるようにする
+        my_mbti = st.selectbox("あなたのMBTIタイプを選択", list(mbti_shadow_map.keys()), key="my_mbti")
+        shadow_mbti = mbti_shadow_map[my_mbti]
+
+        st.info(f"あなたのShadow（影）は... **【 {shadow_mbti} 】** です。")
+
+        if st.button("Shadow Bookを処方する", type="primary", use_container_width=True):
+            from book_catalog import pick_shadow_book
+
+            # カタログから本を先に選び、LLM には解説だけを書かせる
+            book = pick_shadow_book(my_mbti)
+            user_prompt = build_user_prompt(my_mbti, book)
+            messages = build_messages(user_prompt)
+            started = time.perf_counter()
+            # 事前生成 → キャッシュ → 生成 の順に探す
+            stored = prescription_store.lookup(my_mbti, user_prompt)
+            if stored is not None:
+                source, model, suggestion = "store", stored['model'], stored['content']
+            else:
+                source, model = "cache", router.pick("prescription")
+                suggestion = prescription_cache.get(make_key(SYSTEM_PROMPT, user_prompt, model, TEMPERATURE))
+            metrics.CACHE_LOOKUPS.inc(source=source if suggestion is not None else "live")
+            if suggestion is not None:
+                elapsed_ms = (time.perf_counter() - started) * 1000
                 st.session_state['result'] = {
                     "content": suggestion,
-                    "shadow_type": shadow_mbti
+                    "shadow_type": shadow_mbti,
+                    "source": source,
+                    "model": model,
+                    "ttft_ms": elapsed_ms,
+                    "total_ms": elapsed_ms,
                 }
-            except Exception as e:
-                st.error(f"エラーが発生しました: {e}")
-
-with col2:
-    if 'result' in st.session_state:
-        res = st.session_state['result']
-        st.success("処方が完了しました")
-        with st.container(border=True):
-            st.markdown(f"### 📖 {res['shadow_type']}的視点の獲得")
-            st.markdown(res['content'])
-        
-        # 脳内ステータス (レーダーチャート)
-        categories = ['論理', '共感', '想像', '行動', '規律']
-        fig = go.Figure()
-        fig.add_trace(go.Scatterpolar(r=[3, 2, 3, 1, 4], theta=categories, fill='toself', name='現在のあなた'))
-        fig.add_trace(go.Scatterpolar(r=[4, 5, 4, 4, 4], theta=categories, fill='toself', name='読書後の拡張', line_color='pink'))
-        fig.update_layout(polar=dict(radialaxis=dict(visible=True, range=[0, 5])), showlegend=True, height=300)
-        st.plotly_chart(fig, use_container_width=True)
+                st.session_state.pop('job', None)
+            else:
+                # 上流呼び出しは共有イベントループへ投げ、ページの描画はそのまま続ける
+                st.session_state['job'] = {
+                    "job": async_llm.start_stream(router, "prescription", messages=messages, user=llm_user(),
+                                                  **completion_options(book)),
+                    "user_prompt": user_prompt,
+                    "shadow_type": shadow_mbti,
+                }
+
+    with col2:
+        # 生成中の処方はチャートを描いてからこの枠に流し込む
+        job_slot = st.container()
+        if 'result' in st.session_state and 'job' not in st.session_state:
+            render_result(st.session_state['result'])
+
+        if 'result' in st.session_state or 'job' in st.session_state:
+            with metrics.render_phase("radar_chart"):
+                from radar_chart import radar_figure, radar_scores_for_mbti
+
+                # 脳内ステータス (レーダーチャート)。Figure はスコアの組ごとに使い回す
+                st.plotly_chart(radar_figure(*radar_scores_for_mbti(my_mbti, shadow_mbti)), use_container_width=True)
+
+    # 他のフラグメントの操作はこの受信を中断せず、終わるまで待ってから実行される
+    if 'job' in st.session_state:
+        with job_slot:
+            receive_job(prescription_cache)
+
+
+prescription_panel(router, prescription_cache)
 
 st.divider()
 
@@ -154,56 +310,134 @@ st.divider()
 st.divider()
 st.header("みんなの処方箋（コミュニティ）")
 
-# セッションステート初期化（既存の 'reviews' があれば流用、なければダミーを用意）
-if "prescriptions" not in st.session_state:
-    st.session_state["prescriptions"] = st.session_state.get("reviews", [
-        {
-            "mbti": "INFP",
-            "title": "夜と霧",
-            "symptom": "不安・孤独感",
-            "effect": "生きる意味について考え直すきっかけになり、孤独感が和らいだ。"
-        },
-        {
-            "mbti": "ENFJ",
-            "title": "夜明け前",
-            "symptom": "自己肯定感の低下",
-            "effect": "主人公の強さに励まされ、自分を許すことができた。"
-        },
-        {
-            "mbti": "INTP",
-            "title": "ファクトフルネス",
-            "symptom": "世の中への不安",
-            "effect": "データで世界を見られるようになり、不安が少し減った。"
-        },
-    ])
-
 # 選択肢定義
 mbti_options = ["INTJ","INTP","ENTJ","ENTP","INFJ","INFP","ENFJ","ENFP","ISTJ","ISFJ","ESTJ","ESFJ","ISTP","ISFP","ESTP","ESFP"]
 symptom_options = ["不安・孤独感","抑うつ気味","自己肯定感の低下","仕事の悩み","人間関係","睡眠障害","その他"]
 
 # タブ構成
-tab_view, tab_write = st.tabs(["💊 効能を見る", "✍️ 処方箋を書く"])
+tab_view, tab_search, tab_write = st.tabs(["💊 効能を見る", "🔍 悩みから探す", "✍️ 処方箋を書く"])
+
+FEED_PAGE_SIZE = 20
+ALL_OPTION = "すべて"
+
+
+def reset_feed_cursor():
+    # フィルタが変わったら先頭ページに戻す
+    st.session_state['feed_cursors'] = [None]
+
+
+def push_feed_cursor(cursor):
+    st.session_state['feed_cursors'].append(cursor)
+
+
+def pop_feed_cursor():
+    st.session_state['feed_cursors'].pop()
+
+
+if 'feed_cursors' not in st.session_state:
+    reset_feed_cursor()
+
 
 # 「効能を見る」タブ
-with tab_view:
-    reviews = st.session_state.get("prescriptions", [])
-    if not reviews:
-        st.info("まだ投稿がありません。あなたの処方箋をシェアしてみましょう。")
-    else:
-        for i, r in enumerate(reviews):
-            with st.container():
-                cols = st.columns([1, 4])
-                cols[0].markdown(f"**{r.get('mbti','')}**")
-                cols[1].markdown(
-                    f"**{r.get('title','タイトル未設定')}**  \n\n"
-                    f"**症状:** {r.get('symptom','')}  \n\n"
-                    f"**効能:** {r.get('effect','')}"
-                )
-            if i != len(reviews) - 1:
-                st.markdown("---")
+@st.fragment
+def community_feed(community_store):
+    with metrics.render_phase("community_feed"):
+        filter_cols = st.columns(2)
+        feed_mbti = filter_cols[0].selectbox("MBTIで絞り込む", [ALL_OPTION] + mbti_options, key="feed_mbti", on_change=reset_feed_cursor)
+        feed_symptom = filter_cols[1].selectbox("症状で絞り込む", [ALL_OPTION] + symptom_options, key="feed_symptom", on_change=reset_feed_cursor)
+        filters = {
+            "mbti": None if feed_mbti == ALL_OPTION else feed_mbti,
+            "symptom": None if feed_symptom == ALL_OPTION else feed_symptom,
+        }
+        # feed_cursors はこれまでに開いたページの開始カーソル（戻る用）
+        cursors = st.session_state['feed_cursors']
+        reviews, next_cursor = community_store.page(limit=FEED_PAGE_SIZE, before_id=cursors[-1], **filters)
+        if not reviews:
+            st.info("まだ投稿がありません。あなたの処方箋をシェアしてみましょう。")
+        else:
+            for i, r in enumerate(reviews):
+                with st.container():
+                    cols = st.columns([1, 4])
+                    cols[0].markdown(f"**{r.mbti}**")
+                    cols[1].markdown(
+                        f"**{r.title}**  \n\n"
+                        f"**症状:** {r.symptom}  \n\n"
+                        f"**効能:** {r.effect}"
+                    )
+                if i != len(reviews) - 1:
+                    st.markdown("---")
+
+        nav = st.columns([1, 2, 1])
+        # カーソルはコールバックで動かし、続くフラグメントの再実行でそのページを描く
+        nav[0].button("← 新しい投稿", disabled=len(cursors) == 1, key="feed_prev", on_click=pop_feed_cursor)
+        nav[1].caption(f"{len(cursors)} ページ目 / 全 {community_store.count(**filters)} 件")
+        nav[2].button("古い投稿 →", disabled=next_cursor is None, key="feed_next",
+                      on_click=push_feed_cursor, args=(next_cursor,))
+
+
+def worry_namespace(mbti, model):
+    # システムプロンプト・モデル・温度・MBTI が同じ相談の間でだけ回答を使い回す
+    return make_key(SYSTEM_PROMPT, mbti, model, TEMPERATURE)
+
+
+def ask_worry(worry, mbti, router, slot):
+    """悩みへの処方を似た相談の回答から探し、無ければ slot に流し込みながら生成する"""
+    semantic_cache = get_semantic_cache()
+    model = router.pick("prescription")
+    cached = semantic_cache.get(worry_namespace(mbti, model), worry)
+    metrics.CACHE_LOOKUPS.inc(source="semantic" if cached is not None else "live")
+    if cached is not None:
+        content, similarity = cached
+        return {"worry": worry, "content": content, "source": "semantic", "model": model, "similarity": similarity}
+    job = async_llm.start_stream(router, "prescription", messages=build_messages(build_worry_prompt(mbti, worry)),
+                                 user=llm_user(), **completion_options())
+    with slot.container(border=True):
+        content = st.write_stream(job.iter_text()) if STREAMING else job.text()
+    semantic_cache.put(worry_namespace(mbti, job.model), worry, content)
+    return {"worry": worry, "content": content, "source": "live", "model": job.model}
+
+
+# 「悩みから探す」タブ
+@st.fragment
+def community_search_panel(community_search, router):
+    with metrics.render_phase("search"):
+        query = st.text_input("今の悩みを入力", placeholder="例: 将来が不安だ", key="search_query")
+        if query:
+            hits = community_search.search(query, limit=10)
+            if not hits:
+                st.info("該当する悩み・処方箋が見つかりませんでした。")
+            for score, kind, doc_id, item in hits:
+                if kind == "scenario":
+                    st.markdown(f"🗂️ **{item.button_text}**  （{item.category}）")
+                else:
+                    st.markdown(f"💊 **{item.title}** — {item.mbti} / {item.symptom}  \n{item.effect}")
+        ask = bool(query) and st.button("この悩みに効く本をAIに相談する", key="worry_ask")
+        # 生成中はこの枠に流し込み、終わったら結果の表示で置き換える
+        worry_slot = st.empty()
+        failed = False
+        if ask:
+            try:
+                st.session_state['worry_result'] = ask_worry(query, st.session_state['my_mbti'], router, worry_slot)
+            except Exception as e:
+                failed = True
+                show_llm_error(worry_slot, e)
+        worry = st.session_state.get('worry_result')
+        if worry is not None and not failed:
+            with worry_slot.container():
+                with st.container(border=True):
+                    st.markdown(f"### 💭 「{worry['worry']}」への処方")
+                    st.markdown(worry['content'])
+                if worry['source'] == "semantic":
+                    st.caption(f"似た相談への回答 (類似度 {worry['similarity']:.2f})")
+                else:
+                    st.caption(f"AI生成 ({worry['model']})")
+
 
 # 「処方箋を書く」タブ
-with tab_write:
+@st.fragment
+def write_form(community_store):
+    if st.session_state.pop('post_notice', None):
+        st.success("投稿しました。みんなの処方箋で確認できます。")
     with st.form("write_prescription_form"):
         mbti = st.selectbox("あなたのMBTI", mbti_options, index=mbti_options.index("INFP") if "INFP" in mbti_options else 0)
         title = st.text_input("本のタイトル", "")
@@ -211,13 +445,89 @@ with tab_write:
         effect = st.text_area("効能（どう救われたか）", "")
         submitted = st.form_submit_button("投稿する")
         if submitted:
-            new_review = {
-                "mbti": mbti,
-                "title": title or "タイトル未入力",
-                "symptom": symptom,
-                "effect": effect or ""
-            }
-            # 新しい投稿を先頭に追加して即時反映
-            st.session_state["prescriptions"].insert(0, new_review)
-            st.success("投稿しました。みんなの処方箋で確認できます。")
-            
\ No newline at end of file
+            try:
+                new_review = Post(
+                    mbti=mbti,
+                    title=title or "タイトル未入力",
+                    symptom=symptom,
+                    effect=effect or "",
+                )
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                # 共有ストアに追記し、フィードにも反映されるようページ全体を描き直す
+                community_store.add(new_review)
+                st.session_state['post_notice'] = True
+                reset_feed_cursor()
+                st.rerun()
+
+
+with tab_view:
+    community_feed(community_store)
+
+with tab_search:
+    community_search_panel(community_search, router)
+
+with tab_write:
+    write_form(community_store)
+
+# ==========================================
+# キャラクターとのチャット
+# ==========================================
+st.divider()
+st.header("キャラクターと話す")
+
+
+def default_character_index(characters, mbti):
+    # MBTI から推定した軸プロフィールで、いちばん合うキャラクターを初期選択にする
+    from book_catalog import axes_from_mbti
+    from matcher import get_matcher
+
+    return characters.index(get_matcher().match(dict(zip(AXES, axes_from_mbti(mbti)))))
+
+
+@st.fragment
+def character_chat(router, characters):
+    # 開くまではマッチャー（numpy）も読み込まない
+    if not st.toggle("チャットを開く", key="chat_open"):
+        return
+    with metrics.render_phase("chat"):
+        index = default_character_index(characters, st.session_state.get('my_mbti', "INFP"))
+        character = st.selectbox("話し相手", characters, index=index, format_func=lambda c: f"{c.name}（{c.catchphrase}）",
+                                 key="chat_character")
+        # 会話はキャラクターごとに session_state に持つ（履歴の上限と要約は ChatSession が管理する）
+        sessions = st.session_state.setdefault('chat_sessions', {})
+        session = sessions.get(character.id)
+        if session is None:
+            session = sessions[character.id] = chat_engine.session_from_env(character)
+
+        if session.summary:
+            with st.expander("これまでの会話の要約"):
+                st.markdown(session.summary)
+        for message in session.transcript():
+            with st.chat_message(message['role']):
+                st.markdown(message['content'])
+
+        user_message = st.chat_input(f"{character.name}に話しかける", key="chat_input")
+        if user_message:
+            with st.chat_message("user"):
+                st.markdown(user_message)
+            with st.chat_message("assistant"):
+                try:
+                    job = chat_engine.start_reply_stream(router, session, user_message, user=llm_user())
+                    if STREAMING:
+                        content = st.write_stream(job.iter_text())
+                    else:
+                        content = job.text()
+                        st.markdown(content)
+                except Exception as e:
+                    # 返答の無い発言は履歴から外して、送り直せるようにする
+                    session.cancel_turn()
+                    show_llm_error(st, e)
+                else:
+                    session.record_reply(content)
+
+
+character_chat(router, get_master_data().characters)
+
+startup.finish()
@@ -0,0 +1,213 @@
+"""LLM 呼び出しを非同期で走らせるための共有イベントループ。
+
+プロセスに1本だけバックグラウンドスレッドでイベントループを回し、
+各セッションのスクリプトスレッドはリクエストを投げて描画を続けられるようにする。
+上流への同時リクエスト数はセマフォでプロセスごとに制限する。
+同じリクエスト（種別・メッセージ・生成パラメータ）が生成中なら、新しく投げずにその生成を共有する。
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+import metrics
+
+
+class LoopRunner:
+    """デーモンスレッド上のイベントループにコルーチンを投げ込む"""
+
+    def __init__(self, max_concurrency=8, coalesce_timeout=30.0):
+        self.max_concurrency = max_concurrency
+        # 生成中のジョブに相乗りできる期間（秒）。0 で相乗りしない
+        self.coalesce_timeout = coalesce_timeout
+        self.loop = asyncio.new_event_loop()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self._thread = threading.Thread(target=self._run, name="async-llm", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """コルーチンを実行し concurrent.futures.Future を返す"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    @property
+    def in_flight(self):
+        # Semaphore._value は空き枠の数
+        return self.max_concurrency - self.semaphore._value
+
+
+class StreamJob:
+    """実行中の生成ジョブ。届いたテキスト片は parts に貯め、複数の読み手がそれぞれの位置から読む"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.ttft_ms = None
+        self.total_ms = None
+        self.model = None
+        self.error = None
+        self.parts = []
+        self.future = None
+        # 読み手が次のテキスト片を待つ既定の上限（秒）。None なら待ち続ける
+        self.read_timeout = None
+        self._finished = False
+        self._cond = threading.Condition()
+
+    # --- イベントループ側 ---
+    def _push(self, text):
+        with self._cond:
+            if self.ttft_ms is None:
+                self.ttft_ms = (time.perf_counter() - self.started_at) * 1000
+            self.parts.append(text)
+            self._cond.notify_all()
+
+    def _finish(self, error=None):
+        with self._cond:
+            self.error = error
+            self.total_ms = (time.perf_counter() - self.started_at) * 1000
+            self._finished = True
+            self._cond.notify_all()
+
+    # --- 描画スレッド側 ---
+    def iter_text(self, timeout=None):
+        """届いたテキスト片を順に返す。再実行で途中から読み直しても、既に届いた分から返す。
+
+        timeout を省くと read_timeout（start_stream がルーターのタイムアウトから決める）まで待つ。
+        """
+        if timeout is None:
+            timeout = self.read_timeout
+        position = 0
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: len(self.parts) > position or self._finished, timeout):
+                    raise TimeoutError("生成の続きが届きません")
+                new_parts = self.parts[position:]
+                finished = self._finished
+            if new_parts:
+                position += len(new_parts)
+                yield "".join(new_parts)
+            if finished and position == len(self.parts):
+                break
+        if self.error is not None:
+            raise self.error
+
+    def text(self, timeout=None):
+        """完了まで待って全文を返す（timeout は iter_text と同じく片ごとの待ち時間）"""
+        for _ in self.iter_text(timeout=timeout):
+            pass
+        return "".join(self.parts)
+
+    @property
+    def done(self):
+        return self._finished or (self.future is not None and self.future.done())
+
+
+async def _run_stream(runner, router, request_class, job, kwargs):
+    try:
+        # レート制限の順番待ちは同時実行数の枠の外で行う。枠を取ってから待つと、
+        # 1人の連投で枠が埋まり、他のユーザーが枠の前で先着順に並ぶことになる
+        reservation = await router.areserve(**kwargs)
+        try:
+            await runner.semaphore.acquire()
+        except BaseException:
+            await router.arelease(reservation)
+            raise
+        # ストリームを読み切るまで枠を確保しておく
+        try:
+            stream, job.model = await router.acomplete(request_class, stream=True, reservation=reservation, **kwargs)
+            async for chunk in stream:
+                # Groq は最後のチャンクの x_groq.usage にトークン数を載せてくる
+                x_groq = getattr(chunk, "x_groq", None)
+                if x_groq is not None:
+                    metrics.record_usage(job.model, getattr(x_groq, "usage", None))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    job._push(delta)
+        finally:
+            runner.semaphore.release()
+    except Exception as e:
+        if job.model is not None:
+            # 接続後のストリーム途中で切れた失敗（接続前の失敗はルーター側で記録済み）
+            metrics.LLM_REQUESTS.inc(model=job.model, request_class=request_class, outcome="stream_" + type(e).__name__)
+        job._finish(e)
+    else:
+        job._finish()
+        if job.ttft_ms is not None:
+            metrics.LLM_TTFT.observe(job.ttft_ms / 1000, model=job.model, request_class=request_class)
+
+
+def request_key(request_class, kwargs):
+    """同じ生成とみなすためのキー（種別・メッセージ・生成パラメータを正規化したもの）"""
+    # user はレート制限と台帳のためだけの値なので含めない（相乗りした分は最初の呼び出し元に付く）
+    kwargs = {name: value for name, value in kwargs.items() if name != "user"}
+    return json.dumps([request_class, kwargs], sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def read_timeout(router, request_class):
+    """読み手が次の片を待つ既定の上限。
+
+    上流が止まっていれば、全モデルへのフェイルオーバー（各 request_timeout）とレート制限の待ちを
+    合わせた時間のうちに失敗で終わるはず。それを過ぎても何も届かないならループ側が詰まっている。
+    同時実行数の枠待ちの分として request_timeout をもう1回分足す。
+    """
+    models = len(router.classes.get(request_class, ())) or 1
+    wait = router.limiter.wait_timeout if router.limiter is not None else 0.0
+    return router.request_timeout * (models + 1) + wait
+
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _forget(key, job):
+    with _inflight_lock:
+        if _inflight.get(key) is job:
+            del _inflight[key]
+
+
+def start_stream(router, request_class, coalesce=True, **kwargs):
+    """ストリーミング生成を開始して、すぐに StreamJob を返す。
+
+    coalesce=True なら、同じリクエストが生成中（開始から LLM_COALESCE_TIMEOUT 秒以内）のときは
+    そのジョブを返して上流の呼び出しを1回にまとめる。失敗も全員に同じ例外で伝わる。
+    """
+    runner = get_runner()
+    key = request_key(request_class, kwargs) if coalesce and runner.coalesce_timeout > 0 else None
+    with _inflight_lock:
+        if key is not None:
+            shared = _inflight.get(key)
+            if (shared is not None and not shared.done
+                    and time.perf_counter() - shared.started_at < runner.coalesce_timeout):
+                metrics.LLM_COALESCED.inc(request_class=request_class)
+                return shared
+        job = StreamJob()
+        job.read_timeout = read_timeout(router, request_class)
+        if key is not None:
+            _inflight[key] = job
+    job.future = runner.submit(_run_stream(runner, router, request_class, job, kwargs))
+    if key is not None:
+        job.future.add_done_callback(lambda _: _forget(key, job))
+    return job
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    """プロセス共有の LoopRunner を返す"""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = LoopRunner(
+                    int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+                    coalesce_timeout=float(os.getenv("LLM_COALESCE_TIMEOUT", "30")),
+                )
+    return _runner
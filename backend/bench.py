@@ -0,0 +1,293 @@
+"""本物の Groq を使わない負荷試験。
+
+mock_groq のモックサーバーをプロセス内で立ち上げ（または --base-url で外部のモックを指定し）、
+処方・投稿の流れを N 人分の同時セッションで繰り返して、スループットと p50 / p95 / p99 を出す。
+
+    python bench.py --scenario prescription_stream --sessions 20 --iterations 10
+    python bench.py --scenario mixed --sessions 50 --duration 60 --rate-429 0.05
+    python bench.py --scenario community --sessions 8 --max-p95-ms 50     # 超えたら終了コード 1
+
+シナリオ:
+    prescription         処方の生成（ストリーミングなし、warmup.py と同じ呼び方）
+    prescription_stream  処方の生成（async_llm 経由のストリーミング、app.py と同じ呼び方）
+    community            投稿の追加 → フィードの1ページ目 → 件数 → 検索
+    mixed                prescription_stream と community を交互に
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import mock_groq
+
+SCENARIOS = ("prescription", "prescription_stream", "community", "mixed")
+SYMPTOMS = ["不安・孤独感", "抑うつ気味", "自己肯定感の低下", "仕事の悩み", "人間関係", "睡眠障害", "その他"]
+SEARCH_QUERIES = ["眠れない", "人間関係", "仕事", "自己肯定感", "孤独"]
+
+
+def percentile(sorted_values, q):
+    """ソート済みの値から最近傍順位法で分位点を返す"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+class Recorder:
+    """操作ごとの所要時間とエラーをスレッドをまたいで集める"""
+
+    def __init__(self):
+        self.samples = {}  # 操作名 -> [秒, ...]
+        self.errors = {}  # 操作名 -> {例外名: 件数}
+        self._lock = threading.Lock()
+
+    def measure(self, op, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                errors = self.errors.setdefault(op, {})
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            return None
+        self.add(op, time.perf_counter() - start)
+        return result
+
+    def add(self, op, seconds):
+        with self._lock:
+            self.samples.setdefault(op, []).append(seconds)
+
+    def report(self, elapsed):
+        with self._lock:
+            ops = sorted(set(self.samples) | set(self.errors))
+            rows = {}
+            for op in ops:
+                values = sorted(self.samples.get(op, []))
+                errors = dict(self.errors.get(op, {}))
+                total = len(values) + sum(errors.values())
+                rows[op] = {
+                    "ok": len(values),
+                    "errors": errors,
+                    "error_rate": (total - len(values)) / total if total else 0.0,
+                    "throughput": len(values) / elapsed if elapsed else 0.0,
+                    "p50_ms": _ms(percentile(values, 0.50)),
+                    "p95_ms": _ms(percentile(values, 0.95)),
+                    "p99_ms": _ms(percentile(values, 0.99)),
+                    "max_ms": _ms(values[-1] if values else None),
+                }
+        return rows
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+# --- シナリオ ---
+class Scenario:
+    def __init__(self, name, recorder, seed=None):
+        self.name = name
+        self.recorder = recorder
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._router = None
+        self._community = None
+
+    def choice(self, values):
+        with self._random_lock:
+            return self._random.choice(values)
+
+    # 必要になったものだけ組み立てる（community だけなら Groq クライアントは作らない）
+    @property
+    def router(self):
+        if self._router is None:
+            from model_router import get_router
+
+            self._router = get_router(probe=False)
+        return self._router
+
+    @property
+    def community(self):
+        if self._community is None:
+            from community_store import CommunityStore
+            from master_data import get_master_data
+            from search_index import CommunitySearch
+
+            store = CommunityStore(os.environ["COMMUNITY_DB"])
+            store.seed_if_empty()
+            self._community = (store, CommunitySearch(get_master_data().scenarios, store))
+        return self._community
+
+    def _prompt(self):
+        from book_catalog import pick_shadow_book
+        from prompts import build_messages, build_user_prompt, completion_options, mbti_shadow_map
+
+        mbti = self.choice(list(mbti_shadow_map))
+        book = pick_shadow_book(mbti)
+        return build_messages(build_user_prompt(mbti, book)), completion_options(book)
+
+    def prescription(self):
+        messages, options = self._prompt()
+        self.recorder.measure("prescription", self.router.complete, "prescription", messages=messages, **options)
+
+    def prescription_stream(self):
+        import async_llm
+
+        messages, options = self._prompt()
+
+        def run():
+            job = async_llm.start_stream(self.router, "prescription", messages=messages, **options)
+            job.text()
+            return job
+
+        job = self.recorder.measure("prescription_stream", run)
+        if job is not None and job.ttft_ms is not None:
+            self.recorder.add("prescription_stream.ttft", job.ttft_ms / 1000)
+
+    def community_flow(self):
+        from community_store import Post
+
+        store, search = self.community
+        post = Post(
+            mbti=self.choice(["INFP", "ENTJ", "ISTJ", "ESFP"]),
+            title=f"ベンチマークの本 {self.choice(range(1000))}",
+            symptom=self.choice(SYMPTOMS),
+            effect="負荷試験用の投稿です。",
+        )
+        self.recorder.measure("community.post", store.add, post)
+        self.recorder.measure("community.page", store.page, limit=10)
+        self.recorder.measure("community.count", store.count)
+        self.recorder.measure("community.search", search.search, self.choice(SEARCH_QUERIES), limit=10)
+
+    def step(self, iteration):
+        if self.name == "prescription":
+            self.prescription()
+        elif self.name == "prescription_stream":
+            self.prescription_stream()
+        elif self.name == "community":
+            self.community_flow()
+        elif iteration % 2 == 0:
+            self.prescription_stream()
+        else:
+            self.community_flow()
+
+
+def run_session(scenario, iterations, deadline, think_ms):
+    iteration = 0
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        if deadline is None and iteration >= iterations:
+            break
+        scenario.step(iteration)
+        iteration += 1
+        if think_ms:
+            time.sleep(think_ms / 1000)
+    return iteration
+
+
+def print_report(rows, elapsed, sessions, upstream_requests):
+    print(f"\n{sessions} sessions, {elapsed:.1f}s elapsed"
+          + (f", {upstream_requests} upstream requests" if upstream_requests is not None else ""))
+    header = f"{'operation':<28}{'ok':>7}{'err%':>7}{'ops/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    print(header)
+    print("-" * len(header))
+
+    def fmt(value):
+        return "-" if value is None else f"{value:.1f}"
+
+    for op, row in rows.items():
+        print(f"{op:<28}{row['ok']:>7}{row['error_rate'] * 100:>7.1f}{row['throughput']:>9.2f}"
+              f"{fmt(row['p50_ms']):>9}{fmt(row['p95_ms']):>9}{fmt(row['p99_ms']):>9}{fmt(row['max_ms']):>9}")
+    for op, row in rows.items():
+        if row["errors"]:
+            print(f"  {op} errors: " + ", ".join(f"{name}={count}" for name, count in sorted(row["errors"].items())))
+
+
+def check_budgets(rows, max_p95_ms, max_error_rate):
+    """予算を超えた操作の説明を返す（空なら合格）"""
+    failures = []
+    for op, row in rows.items():
+        if op.endswith(".ttft"):
+            continue
+        if max_p95_ms is not None and row["p95_ms"] is not None and row["p95_ms"] > max_p95_ms:
+            failures.append(f"{op}: p95 {row['p95_ms']:.1f} ms > {max_p95_ms:.1f} ms")
+        if max_error_rate is not None and row["error_rate"] > max_error_rate:
+            failures.append(f"{op}: error rate {row['error_rate']:.1%} > {max_error_rate:.1%}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="モックの Groq に対して処方・投稿の流れを負荷試験する")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="mixed")
+    parser.add_argument("--sessions", type=int, default=10, help="同時セッション数")
+    parser.add_argument("--iterations", type=int, default=5, help="セッションごとの繰り返し回数")
+    parser.add_argument("--duration", type=float, default=None, help="指定すると回数ではなく秒数で打ち切る")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="操作の合間の待ち時間")
+    parser.add_argument("--base-url", default=None, help="外部で起動したモックの URL（既定: プロセス内で起動）")
+    parser.add_argument("--output", default=None, help="結果を JSON で保存するパス")
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="どれかの操作の p95 がこれを超えたら失敗")
+    parser.add_argument("--max-error-rate", type=float, default=None, help="どれかの操作のエラー率がこれを超えたら失敗")
+    mock_groq.add_config_arguments(parser)
+    args = parser.parse_args(argv)
+
+    # クライアントやストアを作る前に、接続先をモックと一時ファイルへ向けておく
+    server = None
+    if args.base_url:
+        os.environ["GROQ_BASE_URL"] = args.base_url
+    else:
+        server = mock_groq.MockGroqServer(mock_groq.config_from_args(args)).start()
+        os.environ["GROQ_BASE_URL"] = server.base_url
+    os.environ["GROQ_API_KEY"] = "mock"
+    workdir = tempfile.mkdtemp(prefix="shadow-bench-")
+    os.environ["COMMUNITY_DB"] = os.path.join(workdir, "community.db")
+    # RATE_LIMIT_RPM / RATE_LIMIT_TPM を付けて実行すると、レート制限込みの待ち時間を測れる
+    os.environ["RATE_LIMIT_DB"] = os.path.join(workdir, "ratelimit.db")
+    os.environ.setdefault("LLM_MAX_CONCURRENCY", str(args.sessions))
+    os.environ.setdefault("GROQ_POOL_SIZE", str(args.sessions))
+
+    recorder = Recorder()
+    scenario = Scenario(args.scenario, recorder, seed=args.seed)
+    start = time.perf_counter()
+    deadline = time.monotonic() + args.duration if args.duration else None
+    try:
+        with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            futures = [
+                pool.submit(run_session, scenario, args.iterations, deadline, args.think_ms)
+                for _ in range(args.sessions)
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        elapsed = time.perf_counter() - start
+        if server is not None:
+            server.stop()
+
+    rows = recorder.report(elapsed)
+    print_report(rows, elapsed, args.sessions, server.requests if server is not None else None)
+    coalesced = sum(metrics.LLM_COALESCED.collect().values())
+    if coalesced:
+        print(f"{coalesced} requests joined an identical in-flight generation")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "scenario": args.scenario,
+                "sessions": args.sessions,
+                "elapsed": elapsed,
+                "operations": rows,
+            }, f, ensure_ascii=False, indent=2)
+
+    failures = check_budgets(rows, args.max_p95_ms, args.max_error_rate)
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""ローカルの本カタログと Shadow Book の近傍検索。
+
+books.jsonl の各本を「MBTI 4次元 + 診断の4軸」の特徴ベクトルにしておき、
+Shadow タイプのベクトルとのコサイン類似度で候補を選ぶ。
+LLM には選んだ本の解説だけを書かせるので、プロンプトも応答も短くて済む。
+"""
+
+import json
+import os
+import random
+import threading
+from typing import NamedTuple
+
+import numpy as np
+
+from master_data import AXES
+from prompts import mbti_shadow_map
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "books.jsonl")
+
+# MBTI の各文字 → (次元番号, 符号)
+MBTI_DIMENSIONS = {
+    "E": (0, 1), "I": (0, -1),
+    "N": (1, 1), "S": (1, -1),
+    "F": (2, 1), "T": (2, -1),
+    "P": (3, 1), "J": (3, -1),
+}
+
+# MBTI から診断の4軸への対応（プロフィールが無いときの既定値）
+# axis_1 感情(+)/論理(-) ≒ F/T, axis_2 テンポ(+)/物語(-) ≒ J/P,
+# axis_3 抽象(+)/具体(-) ≒ N/S, axis_4 行動(+)/内省(-) ≒ E/I
+_AXES_FROM_MBTI = ((2, 1), (3, -1), (1, 1), (0, 1))
+
+
+class Book(NamedTuple):
+    id: str
+    title: str
+    author: str
+    mbti: str
+    axes: tuple
+
+
+def mbti_vector(mbti):
+    vector = np.zeros(4, dtype=np.float32)
+    for letter in mbti.upper():
+        dim, sign = MBTI_DIMENSIONS[letter]
+        vector[dim] = sign
+    return vector
+
+
+def axes_from_mbti(mbti):
+    dims = mbti_vector(mbti)
+    return np.array([dims[dim] * sign for dim, sign in _AXES_FROM_MBTI], dtype=np.float32)
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+class BookCatalog:
+    def __init__(self, books):
+        self.books = tuple(books)
+        self._by_id = {b.id: i for i, b in enumerate(self.books)}
+        features = np.zeros((len(self.books), 4 + len(AXES)), dtype=np.float32)
+        for i, book in enumerate(self.books):
+            features[i, :4] = mbti_vector(book.mbti)
+            features[i, 4:] = book.axes
+        # 正規化しておけば内積がそのままコサイン類似度になる
+        self.features = _normalize_rows(features)
+        self.features.setflags(write=False)
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or os.getenv("BOOK_CATALOG", DEFAULT_PATH)
+        books = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                row = json.loads(line)
+                axes = tuple(float(v) for v in row["axes"])
+                if len(axes) != len(AXES):
+                    raise ValueError(f"{row['id']}: expected {len(AXES)} axes, got {len(axes)}")
+                books.append(Book(row["id"], row["title"], row["author"], row["mbti"].upper(), axes))
+        return cls(books)
+
+    def query_vector(self, mbti, axes_profile=None):
+        """MBTI と（あれば）軸プロフィールから検索ベクトルを作る"""
+        axes = axes_from_mbti(mbti) if axes_profile is None else np.asarray(
+            [axes_profile.get(axis, 0.0) for axis in AXES] if isinstance(axes_profile, dict) else axes_profile,
+            dtype=np.float32,
+        )
+        vector = np.concatenate([mbti_vector(mbti), axes])
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def top_k(self, vector, k=3, exclude_ids=()):
+        """類似度の高い順に [(類似度, Book), ...] を返す"""
+        scores = self.features @ vector
+        for book_id in exclude_ids:
+            if book_id in self._by_id:
+                scores[self._by_id[book_id]] = -np.inf
+        k = min(k, len(self.books))
+        if k <= 0:
+            return []
+        # 全件ソートせず上位 k 件だけ取り出す
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(float(scores[i]), self.books[i]) for i in top if np.isfinite(scores[i])]
+
+    def recommend(self, shadow_mbti, axes_profile=None, k=3, exclude_ids=()):
+        """Shadow タイプ（とその軸プロフィール）に近い本を k 冊返す"""
+        return self.top_k(self.query_vector(shadow_mbti, axes_profile), k=k, exclude_ids=exclude_ids)
+
+    def __len__(self):
+        return len(self.books)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """プロセス共有のカタログ。ファイルが無ければ None（LLM に本選びから任せる）"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                try:
+                    _catalog = BookCatalog.load()
+                except FileNotFoundError:
+                    return None
+    return _catalog
+
+
+def shadow_choices():
+    # 1タイプあたりの候補数。カタログ 32 冊 / 16 タイプなので既定は 2（1 にすると常に最も近い本）
+    return max(1, int(os.getenv("SHADOW_BOOK_CHOICES", "2")))
+
+
+def shadow_books(mbti):
+    """MBTI の Shadow タイプに近い上位の本（処方の候補）を返す。カタログが無ければ空"""
+    catalog = get_catalog()
+    if catalog is None:
+        return []
+    return [book for _, book in catalog.recommend(mbti_shadow_map[mbti], k=shadow_choices())]
+
+
+def pick_shadow_book(mbti):
+    """Shadow タイプに近い上位の本から1冊をランダムに選ぶ。カタログが無ければ None"""
+    books = shadow_books(mbti)
+    return random.choice(books) if books else None
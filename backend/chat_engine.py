@@ -0,0 +1,155 @@
+"""character_types のキャラクターと話すマルチターンチャット。
+
+システムプロンプトは chat_config（一人称・口調・最初のセリフ）から作り、キャラクターごとに固定する。
+履歴はセッションごとのリングバッファに持ち、毎ターン送るのは
+「固定のシステムプロンプト → これまでの要約 → 予算に収まる直近の発言 → 今回の発言」だけにする。
+先頭が毎回同じなのでプロンプトキャッシュが効き、会話が長くなっても1ターンのトークン数は一定に収まる。
+"""
+
+import os
+from collections import deque
+from functools import lru_cache
+
+from prompts import estimate_tokens
+
+CHAT_TEMPERATURE = 0.8
+# 1メッセージあたりの role などの上乗せ分
+MESSAGE_OVERHEAD_TOKENS = 4
+# 要約に残す1発言あたりの文字数
+SUMMARY_POINT_CHARS = 60
+# 履歴が予算を超えたときに、予算のこの割合まで古い発言を落とす
+TRIM_TARGET = 0.6
+
+
+def message_tokens(message):
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+@lru_cache(maxsize=None)
+def build_system_prompt(character):
+    """キャラクターごとに固定のシステムプロンプト（毎ターン同じ文字列を送る）"""
+    chat = character.chat_config
+    return (
+        f"あなたは「{character.name}」というキャラクターです。決め台詞は「{character.catchphrase}」。\n"
+        f"一人称は「{chat.first_person}」、口調は「{chat.tone}」で、最後までキャラクターを崩さずに話してください。\n"
+        "相手の悩みや気持ちに寄り添い、必要なら本を1冊すすめてください。返答は3〜5文程度に短くまとめてください。"
+    )
+
+
+def extractive_summary(previous, dropped, max_tokens):
+    """古い発言の先頭だけを箇条書きで残す（LLM を呼ばない要約）。新しい要点を優先して max_tokens に収める"""
+    points = [line for line in (previous or "").splitlines() if line.startswith("- ")]
+    for message in dropped:
+        speaker = "相手" if message["role"] == "user" else "あなた"
+        text = " ".join(message["content"].split())
+        if len(text) > SUMMARY_POINT_CHARS:
+            text = text[:SUMMARY_POINT_CHARS] + "…"
+        points.append(f"- {speaker}: {text}")
+    kept = []
+    used = 0
+    for point in reversed(points):
+        cost = estimate_tokens(point) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(point)
+        used += cost
+    return "\n".join(reversed(kept))
+
+
+class ChatSession:
+    """1人のユーザーと1キャラクターの会話。履歴はリングバッファで、溢れた発言は要約に畳む"""
+
+    def __init__(self, character, max_messages=20, token_budget=2000, reply_tokens=300, summary_tokens=200,
+                 summarizer=extractive_summary):
+        if max_messages < 2:
+            raise ValueError("max_messages must be >= 2")
+        self.character = character
+        self.system_prompt = build_system_prompt(character)
+        self.token_budget = token_budget
+        self.reply_tokens = reply_tokens
+        self.summary_tokens = summary_tokens
+        self.summarizer = summarizer
+        self.history = deque(maxlen=max_messages)
+        self.summary = ""
+        self._dropped = []
+        self.history.append({"role": "assistant", "content": character.chat_config.opening_line})
+
+    def _append(self, role, content):
+        if len(self.history) == self.history.maxlen:
+            # 満杯になったら TRIM_TARGET まで一度に空け、溢れた発言は次のターンで要約に畳む
+            while len(self.history) > max(1, int(self.history.maxlen * TRIM_TARGET)):
+                self._dropped.append(self.history.popleft())
+        self.history.append({"role": role, "content": content})
+
+    def _fold(self, dropped):
+        """送らなくなった発言を要約に畳み込む"""
+        self._dropped.extend(dropped)
+        if self._dropped:
+            self.summary = self.summarizer(self.summary, self._dropped, self.summary_tokens)
+            self._dropped = []
+
+    def prefix(self):
+        """毎ターン先頭に付ける部分。要約が変わらない限り同じ内容になる"""
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"これまでの会話の要約:\n{self.summary}"})
+        return messages
+
+    def build_messages(self, user_message):
+        """今回の発言を履歴に加え、予算に収まるメッセージ列を返す"""
+        self._append("user", user_message)
+        recent = list(self.history)
+        limit = self.token_budget - self.reply_tokens - self.summary_tokens - estimate_tokens(self.system_prompt)
+        if sum(message_tokens(m) for m in recent) > limit:
+            # 予算を超えたら TRIM_TARGET まで一度に減らし、要約（＝先頭部分）が変わる回数を抑える
+            target = int(limit * TRIM_TARGET)
+            kept = 0
+            used = 0
+            for message in reversed(recent):
+                cost = message_tokens(message)
+                # 今回の発言は必ず残す
+                if kept and used + cost > target:
+                    break
+                kept += 1
+                used += cost
+            dropped = recent[:len(recent) - kept]
+            for _ in dropped:
+                self.history.popleft()
+            self._fold(dropped)
+        elif self._dropped:
+            self._fold([])
+        return self.prefix() + list(self.history)
+
+    def record_reply(self, content):
+        self._append("assistant", content)
+
+    def cancel_turn(self):
+        """返答を得られなかった最後の発言を取り消す"""
+        if self.history and self.history[-1]["role"] == "user":
+            self.history.pop()
+
+    def completion_options(self):
+        return {"temperature": CHAT_TEMPERATURE, "max_tokens": self.reply_tokens}
+
+    def transcript(self):
+        """画面表示用の履歴（要約に畳んだ発言は含まない）"""
+        return list(self.history)
+
+
+def session_from_env(character, summarizer=extractive_summary):
+    return ChatSession(
+        character,
+        max_messages=int(os.getenv("CHAT_HISTORY_MESSAGES", "20")),
+        token_budget=int(os.getenv("CHAT_TOKEN_BUDGET", "2000")),
+        reply_tokens=int(os.getenv("CHAT_REPLY_TOKENS", "300")),
+        summary_tokens=int(os.getenv("CHAT_SUMMARY_TOKENS", "200")),
+        summarizer=summarizer,
+    )
+
+
+def start_reply_stream(router, session, user_message, user=None):
+    """返答をストリーミングで生成する。完了後に session.record_reply(job.text()) を呼ぶこと"""
+    import async_llm
+
+    return async_llm.start_stream(router, "chat", messages=session.build_messages(user_message), user=user,
+                                  **session.completion_options())
@@ -0,0 +1,248 @@
+"""「みんなの処方箋」の永続ストア（SQLite, WAL モード）。
+
+全セッション・全プロセスで1つの DB ファイルを共有する。
+投稿は追記のみで、表示は新しい順（id 降順）にインデックスから読む。
+"""
+
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+from prompts import mbti_shadow_map
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "community.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mbti TEXT NOT NULL,
+    title TEXT NOT NULL,
+    symptom TEXT NOT NULL,
+    effect TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_posts_mbti ON posts (mbti, id);
+CREATE INDEX IF NOT EXISTS idx_posts_symptom ON posts (symptom, id);
+CREATE INDEX IF NOT EXISTS idx_posts_mbti_symptom ON posts (mbti, symptom, id);
+CREATE INDEX IF NOT EXISTS idx_posts_created_at ON posts (created_at);
+"""
+
+MAX_TITLE_LENGTH = 200
+MAX_EFFECT_LENGTH = 2000
+
+
+@dataclass(frozen=True, slots=True)
+class Post:
+    """みんなの処方箋の1投稿。投稿フォーム・フィードの表示・DB の行で共通に使う"""
+
+    mbti: str
+    title: str
+    symptom: str
+    effect: str
+    created_at: float = None
+    id: int = None
+
+    def __post_init__(self):
+        if self.mbti not in mbti_shadow_map:
+            raise ValueError(f"不明なMBTIタイプです: {self.mbti!r}")
+        if not self.title or len(self.title) > MAX_TITLE_LENGTH:
+            raise ValueError(f"本のタイトルは1〜{MAX_TITLE_LENGTH}文字で入力してください")
+        if not self.symptom:
+            raise ValueError("症状を選択してください")
+        if len(self.effect) > MAX_EFFECT_LENGTH:
+            raise ValueError(f"効能は{MAX_EFFECT_LENGTH}文字以内で入力してください")
+
+    @classmethod
+    def from_dict(cls, data):
+        """辞書から作る。旧 reviews 形式（user_mbti/book/efficacy/date）も変換する"""
+        if "user_mbti" in data or "book" in data or "efficacy" in data:
+            created_at = data.get("created_at")
+            if created_at is None and data.get("date"):
+                created_at = datetime.datetime.strptime(data["date"], "%Y-%m-%d").timestamp()
+            data = {
+                "mbti": data.get("user_mbti", ""),
+                # 旧形式は『』付きで保存されていた
+                "title": data.get("book", "").strip().removeprefix("『").removesuffix("』"),
+                "symptom": data.get("symptom", ""),
+                "effect": data.get("efficacy", ""),
+                "created_at": created_at,
+            }
+        return cls(
+            mbti=data["mbti"],
+            title=data["title"],
+            symptom=data["symptom"],
+            effect=data.get("effect") or "",
+            created_at=data.get("created_at"),
+            id=data.get("id"),
+        )
+
+
+# 初回起動時に入れておくサンプル投稿（古い順）
+DEFAULT_POSTS = [
+    Post.from_dict(p) for p in [
+        {"user_mbti": "INFP", "book": "『夜と霧』", "symptom": "将来への不安", "efficacy": "どんな絶望でも精神の自由は奪えないと知り、呼吸が楽になった。", "date": "2024-03-10"},
+        {"user_mbti": "ENTJ", "book": "『HARD THINGS』", "symptom": "孤独な意思決定", "efficacy": "答えのない恐怖に耐えるのがリーダーだと肯定され、迷いが消えた。", "date": "2024-03-12"},
+        {
+            "mbti": "INTP",
+            "title": "ファクトフルネス",
+            "symptom": "世の中への不安",
+            "effect": "データで世界を見られるようになり、不安が少し減った。"
+        },
+        {
+            "mbti": "ENFJ",
+            "title": "夜明け前",
+            "symptom": "自己肯定感の低下",
+            "effect": "主人公の強さに励まされ、自分を許すことができた。"
+        },
+        {
+            "mbti": "INFP",
+            "title": "夜と霧",
+            "symptom": "不安・孤独感",
+            "effect": "生きる意味について考え直すきっかけになり、孤独感が和らいだ。"
+        },
+    ]
+]
+
+# Post のフィールド順に並べる（Post(*row) で組み立てる）
+_COLUMNS = "mbti, title, symptom, effect, created_at, id"
+
+
+_INSERT = "INSERT INTO posts (mbti, title, symptom, effect, created_at) VALUES (?, ?, ?, ?, ?)"
+
+
+def _params(post, now):
+    return (post.mbti, post.title, post.symptom, post.effect, post.created_at or now)
+
+
+def db_path():
+    return os.getenv("COMMUNITY_DB", DEFAULT_PATH)
+
+
+def count_ttl():
+    return float(os.getenv("COMMUNITY_COUNT_TTL", "10"))
+
+
+class CommunityStore:
+    """スレッドごとに接続を持つ SQLite ストア"""
+
+    def __init__(self, path=None, count_ttl_seconds=None):
+        self.path = path or db_path()
+        self._local = threading.local()
+        # 件数はフィルタごとに短い TTL で覚える。このプロセスで投稿したら捨て、
+        # 他のプロセスの投稿は TTL が切れてから反映される
+        self.count_ttl = count_ttl() if count_ttl_seconds is None else count_ttl_seconds
+        self._counts = {}
+        self._counts_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def add(self, post):
+        """投稿（Post または辞書）を追記して id を返す"""
+        if not isinstance(post, Post):
+            post = Post.from_dict(post)
+        conn = self._connect()
+        with conn:
+            cur = conn.execute(_INSERT, _params(post, time.time()))
+        self._forget_counts()
+        return cur.lastrowid
+
+    def add_many(self, posts):
+        now = time.time()
+        posts = [p if isinstance(p, Post) else Post.from_dict(p) for p in posts]
+        conn = self._connect()
+        with conn:
+            conn.executemany(_INSERT, [_params(p, now) for p in posts])
+        self._forget_counts()
+
+    def seed_if_empty(self, posts=DEFAULT_POSTS):
+        conn = self._connect()
+        with conn:
+            # BEGIN IMMEDIATE で他プロセスと同時に種を入れないようにする
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM posts LIMIT 1").fetchone() is None:
+                now = time.time()
+                conn.executemany(_INSERT, [_params(p, now) for p in posts])
+        self._forget_counts()
+
+    def recent(self, limit=50):
+        """新しい順に最大 limit 件"""
+        rows = self._connect().execute(
+            f"SELECT {_COLUMNS} FROM posts ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [Post(*r) for r in rows]
+
+    def posts_after(self, after_id, limit=500):
+        """id が after_id より大きい投稿を古い順に返す（検索インデックスの差分取り込み用）"""
+        rows = self._connect().execute(
+            f"SELECT {_COLUMNS} FROM posts WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+        ).fetchall()
+        return [Post(*r) for r in rows]
+
+    def page(self, limit=20, before_id=None, mbti=None, symptom=None):
+        """カーソル（id）より古い投稿を新しい順に limit 件返す。
+
+        戻り値は (posts, next_cursor)。次のページが無ければ next_cursor は None。
+        OFFSET を使わないので、何ページ目でもインデックスを辿るだけで済む。
+        """
+        where, params = self._filters(mbti, symptom)
+        if before_id is not None:
+            where.append("id < ?")
+            params.append(before_id)
+        sql = f"SELECT {_COLUMNS} FROM posts"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = [Post(*r) for r in self._connect().execute(sql, params).fetchall()]
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, rows[-1].id
+        return rows, None
+
+    def count(self, mbti=None, symptom=None):
+        """フィルタに合う投稿数。count_ttl 秒以内に数えたものはそのまま返す"""
+        key = (mbti or None, symptom or None)
+        now = time.monotonic()
+        with self._counts_lock:
+            cached = self._counts.get(key)
+        if cached is not None and now - cached[0] < self.count_ttl:
+            return cached[1]
+        where, params = self._filters(mbti, symptom)
+        sql = "SELECT COUNT(*) FROM posts"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        total = self._connect().execute(sql, params).fetchone()[0]
+        with self._counts_lock:
+            # フィルタの組み合わせは有限だが、API から任意の文字列が来ても増え続けないようにする
+            if len(self._counts) >= 1024:
+                self._counts.clear()
+            self._counts[key] = (now, total)
+        return total
+
+    def _forget_counts(self):
+        with self._counts_lock:
+            self._counts.clear()
+
+    @staticmethod
+    def _filters(mbti, symptom):
+        where, params = [], []
+        if mbti:
+            where.append("mbti = ?")
+            params.append(mbti)
+        if symptom:
+            where.append("symptom = ?")
+            params.append(symptom)
+        return where, params
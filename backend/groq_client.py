@@ -0,0 +1,313 @@
+"""プロセス全体で共有する Groq クライアント。
+
+Streamlit はスクリプトを毎回再実行するため、クライアントをここで一度だけ作り、
+HTTP コネクションプール（keep-alive）を全セッションで使い回す。
+リクエストごとのタイムアウト、429/5xx に対する指数バックオフ（retry-after 優先）、
+連続失敗したモデルへの送信を止める（モデルごとの）サーキットブレーカーもここで扱う。
+groq / httpx は import が重いので、SDK クライアントは最初に使うときに作る。
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+
+# リトライ対象のステータスコード
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(RuntimeError):
+    """サーキットブレーカーが開いていて上流へ送信できない"""
+
+
+class CircuitBreaker:
+    """連続失敗が閾値を超えたら一定時間リクエストを遮断する"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """送信してよければ True（half_open では試しに通す）"""
+        with self._lock:
+            return self._state() != "open"
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state() == "half_open" or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+
+
+class BreakerPool:
+    """モデルごとの CircuitBreaker。1つのモデルの障害で他のモデルへのフェイルオーバーまで止めない"""
+
+    def __init__(self, factory=CircuitBreaker):
+        self._factory = factory
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, model):
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(model)
+                if breaker is None:
+                    breaker = self._breakers[model] = self._factory()
+        return breaker
+
+    def states(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {model: breaker.state for model, breaker in breakers.items()}
+
+
+def _status_code(error):
+    return getattr(error, "status_code", None)
+
+
+def is_retryable(error):
+    """一時的な失敗（接続・タイムアウト・429・5xx）なら True"""
+    import groq
+
+    if isinstance(error, (groq.APIConnectionError, groq.APITimeoutError)):
+        return True
+    return _status_code(error) in RETRY_STATUS
+
+
+def is_timeout(error):
+    import groq
+
+    return isinstance(error, groq.APITimeoutError)
+
+
+def retry_after_seconds(error):
+    """レスポンスの retry-after ヘッダ（秒）を返す。無ければ None"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def backoff_delay(attempt, error, base=0.5, cap=8.0):
+    """retry-after があればそれに従い、無ければフルジッター付き指数バックオフ"""
+    wait = retry_after_seconds(error)
+    if wait is None:
+        wait = random.uniform(0, min(cap, base * (2 ** attempt)))
+    return min(wait, cap)
+
+
+class _LazyRaw:
+    """SDK クライアント（raw）を、渡されていなければ初回アクセス時に raw_factory で作る"""
+
+    def _init_raw(self, raw, raw_factory):
+        if raw is None and raw_factory is None:
+            raise ValueError("raw or raw_factory is required")
+        self._raw = raw
+        self._raw_factory = raw_factory
+        self._raw_lock = threading.Lock()
+
+    @property
+    def raw(self):
+        if self._raw is None:
+            with self._raw_lock:
+                if self._raw is None:
+                    self._raw = self._raw_factory()
+        return self._raw
+
+
+class ChatClient(_LazyRaw):
+    """リトライとサーキットブレーカー付きの chat.completions ラッパー"""
+
+    def __init__(self, raw=None, max_retries=3, backoff_base=0.5, backoff_max=8.0, breakers=None, sleep=time.sleep,
+                 raw_factory=None):
+        self._init_raw(raw, raw_factory)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breakers = breakers or BreakerPool()
+        self._sleep = sleep
+
+    def complete(self, retry_timeouts=True, **kwargs):
+        """chat.completions.create を呼ぶ。stream=True のときはストリームを返す。
+
+        retry_timeouts=False ならタイムアウトは同じモデルでリトライせずにすぐ送出する（呼び出し側が次のモデルへ移る）。
+        """
+        breaker = self.breakers.get(kwargs.get("model"))
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(f"{kwargs.get('model')} への送信を一時停止しています")
+            try:
+                result = self.raw.chat.completions.create(**kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                breaker.record_failure()
+                if attempt >= self.max_retries or (not retry_timeouts and is_timeout(e)):
+                    raise
+                self._sleep(backoff_delay(attempt, e, self.backoff_base, self.backoff_max))
+                attempt += 1
+                continue
+            breaker.record_success()
+            return result
+
+
+class AsyncChatClient(_LazyRaw):
+    """ChatClient の asyncio 版。イベントループを止めずにリトライ待ちする"""
+
+    def __init__(self, raw=None, max_retries=3, backoff_base=0.5, backoff_max=8.0, breakers=None, raw_factory=None):
+        self._init_raw(raw, raw_factory)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breakers = breakers or BreakerPool()
+
+    async def complete(self, retry_timeouts=True, **kwargs):
+        """chat.completions.create を await する。stream=True のときは非同期ストリームを返す"""
+        breaker = self.breakers.get(kwargs.get("model"))
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(f"{kwargs.get('model')} への送信を一時停止しています")
+            try:
+                result = await self.raw.chat.completions.create(**kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                breaker.record_failure()
+                if attempt >= self.max_retries or (not retry_timeouts and is_timeout(e)):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt, e, self.backoff_base, self.backoff_max))
+                attempt += 1
+                continue
+            breaker.record_success()
+            return result
+
+
+def _http_settings():
+    import httpx
+
+    timeout = float(os.getenv("GROQ_TIMEOUT", "30"))
+    pool_size = int(os.getenv("GROQ_POOL_SIZE", "20"))
+    limits = httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=60.0,
+    )
+    return timeout, limits
+
+
+def _retry_settings():
+    return int(os.getenv("GROQ_MAX_RETRIES", "3"))
+
+
+def create_breaker():
+    return CircuitBreaker(
+        failure_threshold=int(os.getenv("GROQ_BREAKER_THRESHOLD", "5")),
+        reset_timeout=float(os.getenv("GROQ_BREAKER_RESET", "30")),
+    )
+
+
+def create_breakers():
+    return BreakerPool(create_breaker)
+
+
+def _create_raw():
+    import httpx
+    from groq import Groq
+
+    timeout, limits = _http_settings()
+    return Groq(
+        api_key=os.getenv("GROQ_API_KEY"),
+        http_client=httpx.Client(limits=limits, timeout=httpx.Timeout(timeout, connect=5.0)),
+        timeout=timeout,
+        # リトライはこちらで制御する
+        max_retries=0,
+    )
+
+
+def _create_async_raw():
+    import httpx
+    from groq import AsyncGroq
+
+    timeout, limits = _http_settings()
+    return AsyncGroq(
+        api_key=os.getenv("GROQ_API_KEY"),
+        http_client=httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(timeout, connect=5.0)),
+        timeout=timeout,
+        max_retries=0,
+    )
+
+
+def create_client(breakers=None):
+    """環境変数の設定から ChatClient を組み立てる（SDK クライアントは初回の呼び出しで作る）"""
+    return ChatClient(raw_factory=_create_raw, max_retries=_retry_settings(), breakers=breakers or create_breakers())
+
+
+def create_async_client(breakers=None):
+    """環境変数の設定から AsyncChatClient を組み立てる（SDK クライアントは初回の呼び出しで作る）"""
+    return AsyncChatClient(raw_factory=_create_async_raw, max_retries=_retry_settings(),
+                           breakers=breakers or create_breakers())
+
+
+_client = None
+_async_client = None
+_breakers = None
+_client_lock = threading.Lock()
+
+
+def _shared_breakers():
+    # 同期・非同期クライアントは同じ上流のモデルを叩くので、モデルごとのブレーカーは共有する
+    global _breakers
+    if _breakers is None:
+        _breakers = create_breakers()
+    return _breakers
+
+
+def get_client():
+    """プロセス共有の ChatClient を返す（初回呼び出し時に生成）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_client(_shared_breakers())
+    return _client
+
+
+def get_async_client():
+    """プロセス共有の AsyncChatClient を返す。async_llm のイベントループ上でだけ使うこと"""
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                _async_client = create_async_client(_shared_breakers())
+    return _async_client
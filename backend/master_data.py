@@ -0,0 +1,252 @@
+"""data.py のマスターデータを検証・コンパイルして読み込むローダー。
+
+data.py の辞書を一度だけ検証し、イミュータブルな NamedTuple と ID 引きの表にまとめる。
+コンパイル結果は data.py のハッシュをキーにした pickle スナップショットに保存し、
+次回以降はスナップショットを読むだけで data.py の import も検証も省く。
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from typing import NamedTuple
+
+AXES = ("axis_1", "axis_2", "axis_3", "axis_4")
+
+# matching_logic の極 → (軸, 符号)。符号は diagnostic_questions の A 側が +1
+POLES = {
+    "emotional": ("axis_1", 1),
+    "logical": ("axis_1", -1),
+    "tempo": ("axis_2", 1),
+    "story": ("axis_2", -1),
+    "abstract": ("axis_3", 1),
+    "concrete": ("axis_3", -1),
+    "action": ("axis_4", 1),
+    "reflection": ("axis_4", -1),
+}
+
+SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.py")
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+# スナップショットの形式を変えたら上げる
+FORMAT_VERSION = 1
+
+
+class Choice(NamedTuple):
+    key: str
+    label: str
+    asset_prompt: str
+    scores: tuple  # AXES の順に並べた整数
+
+
+class Question(NamedTuple):
+    id: str
+    type: str
+    question: str
+    asset_prompt: str
+    choices: tuple
+
+
+class ChatConfig(NamedTuple):
+    first_person: str
+    tone: str
+    opening_line: str
+
+
+class Character(NamedTuple):
+    id: str
+    name: str
+    catchphrase: str
+    image_prompt: str
+    matching_logic: tuple  # ((軸, 極), ...)
+    chat_config: ChatConfig
+
+
+class WorryScenario(NamedTuple):
+    id: str
+    category: str
+    button_text: str
+    search_keywords: tuple
+
+
+class MasterData(NamedTuple):
+    questions: tuple
+    characters: tuple
+    scenarios: tuple
+    question_by_id: dict
+    character_by_id: dict
+    scenario_by_id: dict
+    source_hash: str
+
+
+class MasterDataError(ValueError):
+    """マスターデータの検証エラー（問題点をまとめて持つ）"""
+
+    def __init__(self, problems):
+        super().__init__("invalid master data:\n" + "\n".join(f"- {p}" for p in problems))
+        self.problems = problems
+
+
+def _require(item, fields, where, problems):
+    ok = True
+    for field in fields:
+        if not isinstance(item.get(field), str) or not item.get(field):
+            problems.append(f"{where}: missing or empty {field!r}")
+            ok = False
+    return ok
+
+
+def _check_unique(items, kind, problems):
+    seen = set()
+    for item in items:
+        item_id = item.get("id")
+        if item_id in seen:
+            problems.append(f"{kind}: duplicate id {item_id!r}")
+        seen.add(item_id)
+
+
+def compile_master_data(diagnostic_questions, character_types, worry_scenarios, source_hash=""):
+    """生の辞書データを検証して MasterData を返す。問題があれば MasterDataError"""
+    problems = []
+    _check_unique(diagnostic_questions, "diagnostic_questions", problems)
+    _check_unique(character_types, "character_types", problems)
+    _check_unique(worry_scenarios, "worry_scenarios", problems)
+
+    questions = []
+    for q in diagnostic_questions:
+        where = f"question {q.get('id')!r}"
+        if not _require(q, ("id", "type", "question"), where, problems):
+            continue
+        choices = []
+        keys = set()
+        for c in q.get("choices") or ():
+            cwhere = f"{where} choice {c.get('key')!r}"
+            if not _require(c, ("key", "label"), cwhere, problems):
+                continue
+            if c["key"] in keys:
+                problems.append(f"{cwhere}: duplicate key")
+            keys.add(c["key"])
+            scores = c.get("scores")
+            if not isinstance(scores, dict):
+                problems.append(f"{cwhere}: missing 'scores'")
+                continue
+            unknown = set(scores) - set(AXES)
+            if unknown:
+                problems.append(f"{cwhere}: unknown axes {sorted(unknown)}")
+            if not all(isinstance(v, int) for v in scores.values()):
+                problems.append(f"{cwhere}: scores must be integers")
+                continue
+            choices.append(Choice(c["key"], c["label"], c.get("asset_prompt", ""),
+                                  tuple(scores.get(axis, 0) for axis in AXES)))
+        if len(choices) < 2:
+            problems.append(f"{where}: needs at least two valid choices")
+        questions.append(Question(q["id"], q["type"], q["question"], q.get("asset_prompt", ""), tuple(choices)))
+
+    characters = []
+    for ct in character_types:
+        where = f"character {ct.get('id')!r}"
+        if not _require(ct, ("id", "name"), where, problems):
+            continue
+        logic = ct.get("matching_logic")
+        if not isinstance(logic, dict) or not logic:
+            problems.append(f"{where}: missing 'matching_logic'")
+            continue
+        for axis, pole in logic.items():
+            if axis not in AXES:
+                problems.append(f"{where}: unknown axis {axis!r}")
+            elif pole not in POLES or POLES[pole][0] != axis:
+                problems.append(f"{where}: pole {pole!r} does not belong to {axis}")
+        chat = ct.get("chat_config") or {}
+        if not _require(chat, ("first_person", "tone", "opening_line"), f"{where} chat_config", problems):
+            continue
+        characters.append(Character(
+            ct["id"], ct["name"], ct.get("catchphrase", ""), ct.get("image_prompt", ""),
+            tuple(logic.items()),
+            ChatConfig(chat["first_person"], chat["tone"], chat["opening_line"]),
+        ))
+
+    scenarios = []
+    for w in worry_scenarios:
+        where = f"worry scenario {w.get('id')!r}"
+        if not _require(w, ("id", "category", "button_text"), where, problems):
+            continue
+        scenarios.append(WorryScenario(w["id"], w["category"], w["button_text"],
+                                       tuple((w.get("search_keywords") or "").split())))
+
+    if problems:
+        raise MasterDataError(problems)
+
+    questions, characters, scenarios = tuple(questions), tuple(characters), tuple(scenarios)
+    return MasterData(
+        questions,
+        characters,
+        scenarios,
+        {q.id: q for q in questions},
+        {c.id: c for c in characters},
+        {w.id: w for w in scenarios},
+        source_hash,
+    )
+
+
+def source_hash(path=SOURCE_PATH):
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read())
+    digest.update(str(FORMAT_VERSION).encode())
+    return digest.hexdigest()
+
+
+def _snapshot_path(cache_dir, digest):
+    return os.path.join(cache_dir, f"master_data-{digest[:16]}.pickle")
+
+
+def _write_snapshot(path, master):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(master, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load(cache_dir=None, use_cache=True):
+    """スナップショットがあれば読み、無ければ data.py をコンパイルして保存する"""
+    cache_dir = cache_dir or os.getenv("MASTER_DATA_CACHE_DIR", DEFAULT_CACHE_DIR)
+    digest = source_hash()
+    path = _snapshot_path(cache_dir, digest)
+    if use_cache and os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                master = pickle.load(f)
+            if master.source_hash == digest:
+                return master
+        except Exception:
+            # 壊れたスナップショットは作り直す
+            pass
+
+    import data
+    master = compile_master_data(data.diagnostic_questions, data.character_types, data.worry_scenarios, digest)
+    if use_cache:
+        try:
+            _write_snapshot(path, master)
+        except OSError:
+            # 書き込めない環境（読み取り専用コンテナなど）ではキャッシュ無しで動かす
+            pass
+    return master
+
+
+_master = None
+_master_lock = threading.Lock()
+
+
+def get_master_data():
+    """プロセス共有の MasterData"""
+    global _master
+    if _master is None:
+        with _master_lock:
+            if _master is None:
+                _master = load()
+    return _master
@@ -0,0 +1,90 @@
+"""採点結果から character_types（CT01〜CT08）を選ぶマッチャー。
+
+各軸の符号（＋・0・−）の全組み合わせ 3^4 = 81 通りについて、最も合うキャラクターを
+起動時に表へ前計算しておく。リクエスト時はプロフィールを表の番号に変換して引くだけ。
+
+    python matcher.py     # どの組み合わせでも選ばれないキャラクターが無いか確かめる
+"""
+
+import sys
+
+import numpy as np
+
+from master_data import AXES, POLES, get_master_data
+
+
+class CharacterMatcher:
+    def __init__(self, characters):
+        self.axes = AXES
+        self.characters = tuple(characters)
+        self.ids = tuple(c.id for c in self.characters)
+        axis_index = {axis: i for i, axis in enumerate(self.axes)}
+
+        # キャラクター × 軸 の極行列（+1 / -1 / 0=条件なし）。極の検証は master_data で済んでいる
+        poles = np.zeros((len(self.characters), len(self.axes)), dtype=np.int8)
+        for row, character in enumerate(self.characters):
+            for axis, pole in character.matching_logic:
+                poles[row, axis_index[axis]] = POLES[pole][1]
+        self.poles = poles
+
+        # 符号の組み合わせ（各軸 -1/0/+1）を 3 進数で番号付けする
+        self._powers = 3 ** np.arange(len(self.axes), dtype=np.intp)
+        n_codes = 3 ** len(self.axes)
+        digits = (np.arange(n_codes)[:, None] // self._powers) % 3
+        signs = digits - 1
+        scores = signs @ poles.T.astype(np.intp)
+        # 同点ならマスターデータでの並び順が先のキャラクター（argmax は最初の最大値を返す）
+        self.table = scores.argmax(axis=1)
+        self.table_scores = scores.max(axis=1)
+        self.table.setflags(write=False)
+
+    def codes(self, profiles):
+        """(人数, 軸数) のプロフィール（合計点でも正規化後でもよい）を表の番号に変換する"""
+        profiles = np.asarray(profiles)
+        if profiles.ndim != 2 or profiles.shape[1] != len(self.axes):
+            raise ValueError(f"expected shape (n, {len(self.axes)}), got {profiles.shape}")
+        # NaN の符号は NaN で、整数にすると不定な番号になり表の外を引く
+        if not np.isfinite(profiles).all():
+            raise ValueError("profiles must be finite")
+        return ((np.sign(profiles).astype(np.intp) + 1) * self._powers).sum(axis=1)
+
+    def match_batch(self, profiles):
+        """各プロフィールに最も合うキャラクターの番号（self.characters の添字）を返す"""
+        return self.table[self.codes(profiles)]
+
+    def match(self, profile):
+        """{軸: 値} のプロフィール1件から Character を返す"""
+        row = np.array([[profile.get(axis, 0) for axis in self.axes]])
+        return self.characters[self.match_batch(row)[0]]
+
+    def match_ids(self, profiles):
+        return [self.ids[i] for i in self.match_batch(profiles)]
+
+    def unreachable(self):
+        """どの符号の組み合わせでも選ばれないキャラクターの id を、理由とともに返す"""
+        chosen = np.bincount(self.table, minlength=len(self.characters))
+        problems = []
+        for row in np.flatnonzero(chosen == 0):
+            # matching_logic が同じなら、並び順が先のキャラクターが常に勝つ
+            same = [self.ids[i] for i in range(row) if (self.poles[i] == self.poles[row]).all()]
+            reason = f"matching_logic duplicates {same[0]}" if same else "always outscored"
+            problems.append((self.ids[row], reason))
+        return problems
+
+
+_matcher = None
+
+
+def get_matcher():
+    """マスターデータのキャラクターから前計算した共有マッチャー"""
+    global _matcher
+    if _matcher is None:
+        _matcher = CharacterMatcher(get_master_data().characters)
+    return _matcher
+
+
+if __name__ == "__main__":
+    problems = get_matcher().unreachable()
+    for character_id, reason in problems:
+        print(f"FAIL {character_id} is never matched: {reason}", file=sys.stderr)
+    sys.exit(1 if problems else 0)
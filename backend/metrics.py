@@ -0,0 +1,264 @@
+"""レイテンシ・トークン使用量・エラー率の計測。
+
+プロセス内のカウンターとヒストグラムに記録し、次のどちらかで外に出す。
+
+- METRICS_PORT を設定すると、そのポートで Prometheus 形式の /metrics を返す
+  （既定では METRICS_HOST=127.0.0.1 にだけ bind する。ポートを取れるのはホストで最初のプロセスだけ）
+- METRICS_DUMP_PATH を設定すると、METRICS_DUMP_INTERVAL 秒ごとに JSON を書き出す。
+  ワーカーごとに別ファイル（metrics.json なら metrics.<pid>.json）になるので、全体はファイルを合算して見る
+"""
+
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def collect(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+    def snapshot(self):
+        return [{"labels": dict(key), "value": value} for key, value in sorted(self.collect().items())]
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [バケットごとの件数..., 合計, 件数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        with self._lock:
+            return {key: list(series) for key, series in self._series.items()}
+
+    def quantile(self, q, **labels):
+        """バケットから推定した分位点（バケット上限で近似）"""
+        series = self.collect().get(_label_key(labels))
+        if not series or not series[-1]:
+            return None
+        target = q * series[-1]
+        cumulative = 0
+        for bound, count in zip(self.buckets, series):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+    def snapshot(self):
+        result = []
+        for key, series in sorted(self.collect().items()):
+            labels = dict(key)
+            result.append({
+                "labels": labels,
+                "count": series[-1],
+                "sum": series[-2],
+                "p50": self.quantile(0.5, **labels),
+                "p95": self.quantile(0.95, **labels),
+                "p99": self.quantile(0.99, **labels),
+            })
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name, help_text=""):
+        return self._get_or_create(Counter, name, help_text)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def render_prometheus(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {"time": time.time(), "metrics": {m.name: m.snapshot() for m in metrics}}
+
+
+REGISTRY = Registry()
+
+# --- アプリ共通のメトリクス ---
+LLM_REQUESTS = REGISTRY.counter("llm_requests_total", "LLM requests by model, request class and outcome")
+LLM_LATENCY = REGISTRY.histogram("llm_request_seconds", "Time until the LLM response (or stream) is returned")
+LLM_TTFT = REGISTRY.histogram("llm_time_to_first_token_seconds", "Time to the first streamed token")
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "Tokens reported in the Groq usage field")
+LLM_COALESCED = REGISTRY.counter("llm_coalesced_total", "Requests that joined an identical in-flight generation")
+CACHE_LOOKUPS = REGISTRY.counter("prescription_lookups_total", "Prescription lookups by source (store, cache, live)")
+RENDER_LATENCY = REGISTRY.histogram("render_phase_seconds", "Streamlit render time by page phase")
+
+
+def record_llm_call(model, request_class, seconds, error=None):
+    outcome = "ok" if error is None else type(error).__name__
+    LLM_REQUESTS.inc(model=model, request_class=request_class, outcome=outcome)
+    if error is None:
+        LLM_LATENCY.observe(seconds, model=model, request_class=request_class)
+
+
+def record_usage(model, usage):
+    """Groq の usage（オブジェクトでも辞書でもよい）からトークン数を記録する"""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = usage.get(kind) if isinstance(usage, dict) else getattr(usage, kind, None)
+        if value:
+            LLM_TOKENS.inc(value, model=model, kind=kind.removesuffix("_tokens"))
+
+
+def render_phase(phase):
+    return RENDER_LATENCY.time(phase=phase)
+
+
+# --- 出力 ---
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def dump_json(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(REGISTRY.snapshot(), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def dump_path(path, pid=None):
+    """METRICS_DUMP_PATH にプロセス ID を挟んだ、このプロセス用の書き出し先"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid() if pid is None else pid}{ext}"
+
+
+def _dump_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            dump_json(path)
+        except OSError:
+            pass
+
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def start_exporters():
+    """環境変数に応じて /metrics サーバーと JSON ダンプを1回だけ起動する"""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    port = os.getenv("METRICS_PORT")
+    if port:
+        try:
+            server = ThreadingHTTPServer((os.getenv("METRICS_HOST", "127.0.0.1"), int(port)), _Handler)
+        except OSError:
+            # 同じホストの別プロセスが既にポートを使っている
+            server = None
+        if server is not None:
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    path = os.getenv("METRICS_DUMP_PATH")
+    if path:
+        interval = float(os.getenv("METRICS_DUMP_INTERVAL", "60"))
+        threading.Thread(target=_dump_loop, args=(dump_path(path), interval), name="metrics-dump", daemon=True).start()
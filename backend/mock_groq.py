@@ -0,0 +1,284 @@
+"""負荷試験用の Groq 互換モックサーバー。
+
+本物の Groq の枠を使わずに app.py まわりを負荷試験するためのもの。
+/openai/v1/chat/completions（通常・ストリーミング）と /openai/v1/models を返す。
+応答時間の分布、トークンの流れる速さ、429 / 500 の混入率を指定できる。
+
+    python mock_groq.py --port 8008 --latency-ms 400 --tokens-per-sec 120 --rate-429 0.05
+
+クライアント側は GROQ_BASE_URL=http://127.0.0.1:8008 を設定すれば、そのままこちらに向く。
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 応答本文の素材（中身は何でもよいので、日本語の処方箋らしい文を繰り返す）
+_FILLER = (
+    "あなたの影のタイプに効く一冊です。普段とは違う視点で物語を追うことで、"
+    "見落としていた感情や考え方に気づけるはずです。"
+)
+
+
+class MockConfig:
+    """モックの振る舞い。サーバー起動後に書き換えてもよい"""
+
+    def __init__(self, latency_ms=300.0, latency_sigma=0.5, tokens_per_sec=100.0, completion_tokens=200,
+                 rate_429=0.0, rate_500=0.0, retry_after=1.0, unavailable_models=(), seed=None):
+        self.latency_ms = latency_ms  # 最初の応答までの中央値
+        self.latency_sigma = latency_sigma  # 対数正規分布のばらつき（0 なら固定）
+        self.tokens_per_sec = tokens_per_sec  # 0 なら待たずに全部流す
+        self.completion_tokens = completion_tokens
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.retry_after = retry_after
+        self.unavailable_models = set(unavailable_models)  # 404 を返すモデル（フェイルオーバーの確認用）
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_latency(self):
+        with self._lock:
+            if self.latency_sigma <= 0:
+                return self.latency_ms / 1000
+            return self._random.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+
+    def sample_fault(self):
+        """429 / 500 / None のどれかを返す"""
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.rate_429:
+            return 429
+        if roll < self.rate_429 + self.rate_500:
+            return 500
+        return None
+
+
+def _tokens(count):
+    # 1トークン ≒ 2文字として切り出す
+    text = (_FILLER * (count * 2 // len(_FILLER) + 1))[:count * 2]
+    return [text[i:i + 2] for i in range(0, len(text), 2)]
+
+
+def _usage(prompt_tokens, completion_tokens, elapsed):
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "total_time": elapsed,
+    }
+
+
+def _prompt_tokens(messages):
+    return sum(len(str(m.get("content", ""))) for m in messages) // 2
+
+
+class MockGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockGroq/1.0"
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- 書き出し ---
+    def _send_json(self, status, body, headers=()):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status, message, error_type, headers=()):
+        self._send_json(status, {"error": {"message": message, "type": error_type}}, headers)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _write_event(self, body):
+        payload = body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)
+        self._write_chunk(f"data: {payload}\n\n".encode("utf-8"))
+
+    # --- ルーティング ---
+    def do_GET(self):
+        if self.path.rstrip("/") == "/openai/v1/models":
+            self._send_json(200, {"object": "list", "data": []})
+            return
+        self._send_error(404, f"unknown path {self.path}", "not_found")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if self.path.rstrip("/") != "/openai/v1/chat/completions":
+            self._send_error(404, f"unknown path {self.path}", "not_found")
+            return
+        try:
+            request = json.loads(raw or b"{}")
+        except ValueError:
+            self._send_error(400, "invalid JSON body", "invalid_request_error")
+            return
+        self.server.count_request()
+
+        model = request.get("model", "")
+        if model in self.config.unavailable_models:
+            self._send_error(404, f"The model `{model}` does not exist", "invalid_request_error")
+            return
+        fault = self.config.sample_fault()
+        if fault == 429:
+            self._send_error(429, "Rate limit reached (mock)", "rate_limit_exceeded",
+                             headers=[("retry-after", str(self.config.retry_after))])
+            return
+
+        started = time.perf_counter()
+        time.sleep(self.config.sample_latency())
+        if fault == 500:
+            self._send_error(500, "Internal server error (mock)", "internal_server_error")
+            return
+
+        limit = request.get("max_tokens") or request.get("max_completion_tokens") or self.config.completion_tokens
+        tokens = _tokens(min(int(limit), self.config.completion_tokens))
+        prompt_tokens = _prompt_tokens(request.get("messages", []))
+        if request.get("stream"):
+            self._stream(model, tokens, prompt_tokens, started)
+        else:
+            self._complete(model, tokens, prompt_tokens, started)
+
+    def _complete(self, model, tokens, prompt_tokens, started):
+        if self.config.tokens_per_sec > 0:
+            time.sleep(len(tokens) / self.config.tokens_per_sec)
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": _usage(prompt_tokens, len(tokens), time.perf_counter() - started),
+        })
+
+    def _stream(self, model, tokens, prompt_tokens, started):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def chunk(delta, finish_reason=None, **extra):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **extra,
+            }
+
+        interval = 1.0 / self.config.tokens_per_sec if self.config.tokens_per_sec > 0 else 0.0
+        try:
+            self._write_event(chunk({"role": "assistant", "content": ""}))
+            for token in tokens:
+                if interval:
+                    time.sleep(interval)
+                self._write_event(chunk({"content": token}))
+            # 本物と同じく、最後のチャンクの x_groq.usage にトークン数を載せる
+            usage = _usage(prompt_tokens, len(tokens), time.perf_counter() - started)
+            self._write_event(chunk({}, "stop", x_groq={"id": completion_id, "usage": usage}))
+            self._write_event("[DONE]")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが途中で切った
+            self.close_connection = True
+
+
+class MockGroqServer(ThreadingHTTPServer):
+    """バックグラウンドスレッドで動かすモックサーバー。port=0 なら空きポートを使う"""
+
+    daemon_threads = True
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), MockGroqHandler)
+        self.config = config or MockConfig()
+        self.requests = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    def count_request(self):
+        with self._count_lock:
+            self.requests += 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-groq", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def add_config_arguments(parser):
+    """MockConfig の設定を argparse に足す（bench.py と共用）"""
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="最初の応答までの中央値（ミリ秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="応答時間の対数正規分布のばらつき（0 で固定）")
+    parser.add_argument("--tokens-per-sec", type=float, default=100.0, help="トークンを流す速さ（0 で一度に返す）")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="1応答あたりのトークン数の上限")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="429 を返す割合")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="500 を返す割合")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 の retry-after（秒）")
+    parser.add_argument("--unavailable-model", action="append", default=[], help="404 を返すモデル（複数指定可）")
+    parser.add_argument("--seed", type=int, default=None, help="乱数の種")
+
+
+def config_from_args(args):
+    return MockConfig(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        tokens_per_sec=args.tokens_per_sec,
+        completion_tokens=args.completion_tokens,
+        rate_429=args.rate_429,
+        rate_500=args.rate_500,
+        retry_after=args.retry_after,
+        unavailable_models=args.unavailable_model,
+        seed=args.seed,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Groq 互換のモックサーバーを起動する")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8008)
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = MockGroqServer(config_from_args(args), host=args.host, port=args.port)
+    print(f"mock Groq listening on {server.base_url} (GROQ_BASE_URL={server.base_url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""Groq モデルのルーティングとフェイルオーバー。
+
+起動時に候補モデルを並列でプローブしてレイテンシと可用性を記録し、
+リクエスト種別ごとに候補の並び順で、健全かつプローブのレイテンシが許容範囲内のモデルを選ぶ。
+呼び出しが失敗・タイムアウトしたら、同じリクエスト内で次の候補へ切り替える。
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from groq_client import CircuitOpenError, get_async_client, get_client
+from rate_limiter import estimate_request_tokens, limiter_from_env
+
+# user を渡さなかった呼び出し（バッチ処理など）をまとめる名前
+ANONYMOUS_USER = "anonymous"
+
+# リクエスト種別ごとの候補（先頭ほど優先）
+DEFAULT_CANDIDATES = {
+    "prescription": [
+        "llama-3.3-70b-versatile",
+        "openai/gpt-oss-120b",
+        "llama-3.1-8b-instant",
+    ],
+    "chat": [
+        "llama-3.1-8b-instant",
+        "llama-3.3-70b-versatile",
+    ],
+}
+
+PROBE_MESSAGES = [
+    {"role": "system", "content": "あなたはテスト用の簡易アシスタントです。短く挨拶してください。"},
+    {"role": "user", "content": "こんにちは"},
+]
+
+
+def candidates_from_env(defaults=DEFAULT_CANDIDATES):
+    """MODEL_CANDIDATES_<種別>（カンマ区切り）で候補を上書きする"""
+    classes = {}
+    for request_class, models in defaults.items():
+        value = os.getenv(f"MODEL_CANDIDATES_{request_class.upper()}")
+        if value:
+            models = [m.strip() for m in value.split(",") if m.strip()]
+        classes[request_class] = list(models)
+    return classes
+
+
+class ModelHealth:
+    __slots__ = ("model", "available", "latency_ms", "failures", "checked_at", "last_error")
+
+    def __init__(self, model):
+        self.model = model
+        self.available = True  # 未計測のモデルは使える前提で扱う
+        self.latency_ms = None
+        self.failures = 0
+        self.checked_at = None
+        self.last_error = None
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ModelRouter:
+    def __init__(self, client, classes, probe_timeout=10.0, request_timeout=20.0, cooldown=60.0, smoothing=0.3,
+                 latency_tolerance_ms=1500.0, clock=time.monotonic, async_client=None, limiter=None):
+        self.client = client
+        self.async_client = async_client
+        # rate_limiter.RateLimiter。None なら送信前に待たない
+        self.limiter = limiter
+        self.classes = classes
+        self.probe_timeout = probe_timeout
+        self.request_timeout = request_timeout
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        # プローブのレイテンシがこれを超えるモデルは、速いモデルが無いときだけ使う
+        self.latency_tolerance_ms = latency_tolerance_ms
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._health = {}
+        for models in classes.values():
+            for model in models:
+                self._health.setdefault(model, ModelHealth(model))
+
+    # --- 計測結果の記録 ---
+    def record_success(self, model, latency_ms=None):
+        """成功を記録する。latency_ms はプローブの往復時間だけを渡す（本番の呼び出しは生成時間が混ざるので渡さない）"""
+        with self._lock:
+            h = self._health.setdefault(model, ModelHealth(model))
+            if latency_ms is not None:
+                if h.latency_ms is None:
+                    h.latency_ms = latency_ms
+                else:
+                    # 指数移動平均で直近のレイテンシを反映する
+                    h.latency_ms += self.smoothing * (latency_ms - h.latency_ms)
+            h.available = True
+            h.failures = 0
+            h.checked_at = self._clock()
+            h.last_error = None
+
+    def record_failure(self, model, error):
+        with self._lock:
+            h = self._health.setdefault(model, ModelHealth(model))
+            h.available = False
+            h.failures += 1
+            h.checked_at = self._clock()
+            h.last_error = str(error)
+
+    # --- プローブ ---
+    def _probe_one(self, model):
+        start = time.perf_counter()
+        try:
+            # リトライ無しで素のクライアントを叩き、純粋な応答時間を測る
+            self.client.raw.chat.completions.create(
+                model=model,
+                messages=PROBE_MESSAGES,
+                temperature=0.0,
+                max_tokens=1,
+                timeout=self.probe_timeout,
+            )
+        except Exception as e:
+            self.record_failure(model, e)
+            return model, False, e
+        self.record_success(model, (time.perf_counter() - start) * 1000)
+        return model, True, None
+
+    def probe(self, models=None):
+        """候補モデルを並列にプローブし、[(model, ok, error), ...] を返す"""
+        models = list(models or self._health)
+        if not models:
+            return []
+        with ThreadPoolExecutor(max_workers=len(models)) as pool:
+            return list(pool.map(self._probe_one, models))
+
+    # --- 選択 ---
+    def rank(self, request_class):
+        """健全で許容範囲内のモデルを候補の並び順に、次に遅いモデルをレイテンシ順に、
+        最後にクールダウン明けの不調モデルを並べる"""
+        models = self.classes[request_class]
+        now = self._clock()
+        with self._lock:
+            preferred = []
+            slow = []
+            retry = []
+            for order, model in enumerate(models):
+                h = self._health[model]
+                if h.available:
+                    # 未計測のモデルは許容範囲内として並び順どおりに扱う
+                    if h.latency_ms is None or h.latency_ms <= self.latency_tolerance_ms:
+                        preferred.append(model)
+                    else:
+                        slow.append((h.latency_ms, order, model))
+                elif h.checked_at is None or now - h.checked_at >= self.cooldown:
+                    retry.append((h.failures, order, model))
+        return preferred + [m for _, _, m in sorted(slow)] + [m for _, _, m in sorted(retry)]
+
+    def pick(self, request_class):
+        ranked = self.rank(request_class)
+        return ranked[0] if ranked else self.classes[request_class][0]
+
+    def _record_call(self, model, request_class, start, error=None):
+        elapsed = time.perf_counter() - start
+        metrics.record_llm_call(model, request_class, elapsed, error)
+        if error is None:
+            # 所要時間は metrics にだけ残す（ストリームはヘッダーまで、非ストリームは生成完了までで比べられない）
+            self.record_success(model)
+        else:
+            self.record_failure(model, error)
+
+    def _reserve(self, user, kwargs):
+        return self.limiter.acquire(user or ANONYMOUS_USER, estimate_request_tokens(kwargs))
+
+    async def areserve(self, **kwargs):
+        """acomplete に渡す kwargs でレート制限の枠を先に確保する（制限が無ければ None）。
+
+        確保した枠は acomplete(reservation=...) に渡すか、使わなければ arelease で戻すこと。
+        """
+        if self.limiter is None:
+            return None
+        return await self.limiter.aacquire(kwargs.get("user") or ANONYMOUS_USER, estimate_request_tokens(kwargs))
+
+    async def arelease(self, reservation):
+        if reservation is not None:
+            await asyncio.to_thread(self.limiter.release, reservation)
+
+    async def _settled_stream(self, stream, reservation, model):
+        """ストリームをそのまま流し、読み終えたら最後のチャンクの x_groq.usage で精算する"""
+        usage = None
+        try:
+            async for chunk in stream:
+                x_groq = getattr(chunk, "x_groq", None)
+                if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+                    usage = x_groq.usage
+                yield chunk
+        finally:
+            await asyncio.to_thread(self.limiter.settle, reservation, model, usage)
+
+    def complete(self, request_class, **kwargs):
+        """候補を順に試して (レスポンス, 使用モデル) を返す。
+
+        user（ユーザー名など）ごとにレート制限の順番を回し、利用量を台帳に付ける。Groq には送らない。
+        フェイルオーバーしても枠の確保は1リクエストにつき1回。
+        """
+        user = kwargs.pop("user", None)
+        ranked = self.rank(request_class) or list(self.classes[request_class])
+        # 遅いモデルで待ち続けず、タイムアウトしたら同じモデルでリトライせずに次の候補へ移る
+        kwargs.setdefault("timeout", self.request_timeout)
+        reservation = self._reserve(user, kwargs) if self.limiter is not None else None
+        last_error = None
+        try:
+            for model in ranked:
+                start = time.perf_counter()
+                try:
+                    result = self.client.complete(model=model, retry_timeouts=False, **kwargs)
+                except CircuitOpenError as e:
+                    # このモデルはブレーカーが開いているので送らずに次の候補へ
+                    last_error = e
+                    continue
+                except Exception as e:
+                    self._record_call(model, request_class, start, e)
+                    last_error = e
+                    continue
+                self._record_call(model, request_class, start)
+                usage = getattr(result, "usage", None)
+                metrics.record_usage(model, usage)
+                if reservation is not None:
+                    self.limiter.settle(reservation, model, usage)
+                    reservation = None
+                return result, model
+            raise last_error
+        finally:
+            if reservation is not None:
+                # 生成されなかったので仮押さえしたトークンを戻す
+                self.limiter.release(reservation)
+
+    async def acomplete(self, request_class, reservation=None, **kwargs):
+        """complete の asyncio 版。async_client が必要。
+
+        reservation（areserve で確保済みの枠）を渡すとそれを使い、ここでは待たない。
+        """
+        if reservation is None:
+            reservation = await self.areserve(**kwargs)
+        kwargs.pop("user", None)
+        ranked = self.rank(request_class) or list(self.classes[request_class])
+        kwargs.setdefault("timeout", self.request_timeout)
+        last_error = None
+        try:
+            for model in ranked:
+                start = time.perf_counter()
+                try:
+                    result = await self.async_client.complete(model=model, retry_timeouts=False, **kwargs)
+                except CircuitOpenError as e:
+                    last_error = e
+                    continue
+                except Exception as e:
+                    self._record_call(model, request_class, start, e)
+                    last_error = e
+                    continue
+                self._record_call(model, request_class, start)
+                if kwargs.get("stream"):
+                    # usage は最後のチャンクに載るので、読み終えてから精算する
+                    if reservation is not None:
+                        result = self._settled_stream(result, reservation, model)
+                        reservation = None
+                    return result, model
+                usage = getattr(result, "usage", None)
+                metrics.record_usage(model, usage)
+                if reservation is not None:
+                    await asyncio.to_thread(self.limiter.settle, reservation, model, usage)
+                    reservation = None
+                return result, model
+            raise last_error
+        finally:
+            # 生成されなかったので仮押さえしたトークンを戻す
+            await self.arelease(reservation)
+
+    def snapshot(self):
+        with self._lock:
+            return [h.as_dict() for h in self._health.values()]
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def _warm_up(router):
+    # ストリーミング用の SDK クライアント（groq の import を含む）もイベントループの外で先に作っておく
+    if router.async_client is not None:
+        router.async_client.raw
+    router.probe()
+
+
+def get_router(probe=True):
+    """プロセス共有のルーターを返す。初回はバックグラウンドでプローブを走らせる"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ModelRouter(
+                    get_client(),
+                    candidates_from_env(),
+                    probe_timeout=float(os.getenv("MODEL_PROBE_TIMEOUT", "10")),
+                    request_timeout=float(os.getenv("MODEL_REQUEST_TIMEOUT", "20")),
+                    cooldown=float(os.getenv("MODEL_COOLDOWN", "60")),
+                    latency_tolerance_ms=float(os.getenv("MODEL_LATENCY_TOLERANCE_MS", "1500")),
+                    async_client=get_async_client(),
+                    limiter=limiter_from_env(),
+                )
+                if probe:
+                    threading.Thread(target=_warm_up, args=(_router,), daemon=True).start()
+    return _router
@@ -0,0 +1,112 @@
+"""Shadow Book 処方のレスポンスキャッシュ。
+
+同じリクエスト（システムプロンプト・ユーザープロンプト・モデル・温度）に対する
+LLMの回答をプロセス内に保持し、TTL と LRU で上限を管理する。
+variety > 1 のときは1キーにつき最大 variety 件の回答を貯め、順番に返す。
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(system_prompt, user_prompt, model, temperature):
+    """リクエスト全体からキャッシュキーを作る"""
+    system_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    return (system_hash, user_prompt, model, round(float(temperature), 3))
+
+
+class _Entry:
+    __slots__ = ("answers", "cursor")
+
+    def __init__(self):
+        self.answers = []  # [(保存時刻, 回答テキスト), ...]
+        self.cursor = 0
+
+
+class PrescriptionCache:
+    """TTL + LRU 付きの処方キャッシュ（スレッドセーフ）"""
+
+    def __init__(self, max_entries=256, ttl_seconds=24 * 60 * 60, variety=1, clock=time.monotonic):
+        if max_entries < 1:
+            raise ValueError("max_entries must be >= 1")
+        if variety < 1:
+            raise ValueError("variety must be >= 1")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.variety = variety
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _purge_expired(self, entry, now):
+        if self.ttl_seconds is None:
+            return
+        alive = [(ts, text) for ts, text in entry.answers if now - ts < self.ttl_seconds]
+        if len(alive) != len(entry.answers):
+            entry.answers = alive
+            entry.cursor = 0
+
+    def get(self, key):
+        """キャッシュ済みの回答を返す。
+
+        期限切れ・未登録、または variety 件に満たない（新しい回答を増やしたい）
+        場合は None を返し、ミスとして数える。
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._purge_expired(entry, now)
+                if not entry.answers:
+                    del self._entries[key]
+                    entry = None
+            if entry is None or len(entry.answers) < self.variety:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            text = entry.answers[entry.cursor % len(entry.answers)][1]
+            entry.cursor = (entry.cursor + 1) % len(entry.answers)
+            self.hits += 1
+            return text
+
+    def put(self, key, text):
+        """回答を登録する。プールが満杯なら最も古い回答を置き換える"""
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry()
+                self._entries[key] = entry
+            else:
+                self._purge_expired(entry, now)
+            entry.answers.append((now, text))
+            if len(entry.answers) > self.variety:
+                entry.answers.pop(0)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
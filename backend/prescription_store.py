@@ -0,0 +1,101 @@
+"""事前生成した処方の保存先（JSON Lines）。
+
+warmup.py が全 MBTI タイプ分の処方を書き出し、app.py は起動時に読み込んで最優先で返す。
+1行に1件 {"mbti", "shadow_type", "model", "system_hash", "user_prompt",
+"temperature", "content", "generated_at"} を保存する。
+"""
+
+import hashlib
+import json
+import os
+import random
+import tempfile
+import time
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prescriptions.jsonl")
+
+
+def store_path():
+    return os.getenv("PRESCRIPTION_STORE", DEFAULT_PATH)
+
+
+def system_hash(system_prompt):
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+
+
+def write_store(records, path=None):
+    """レコードを一時ファイルに書いてから置き換える（読み込み中のプロセスを壊さない）"""
+    path = path or store_path()
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".prescriptions-", suffix=".jsonl")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+                f.write("\n")
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class PrescriptionStore:
+    """MBTI ごとの事前生成済み処方。古いもの・プロンプトが変わったものは返さない"""
+
+    def __init__(self, records=(), system_prompt="", max_age=7 * 24 * 60 * 60, clock=time.time):
+        self.max_age = max_age
+        self._system_hash = system_hash(system_prompt)
+        self._clock = clock
+        self._by_mbti = {}
+        for record in records:
+            self._by_mbti.setdefault(record["mbti"], []).append(record)
+
+    @classmethod
+    def load(cls, path=None, **kwargs):
+        """ファイルが無い・壊れている行は無視して読み込む"""
+        path = path or store_path()
+        records = []
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+        return cls(records, **kwargs)
+
+    def is_fresh(self, record):
+        if record.get("system_hash") != self._system_hash:
+            return False
+        if self.max_age is None:
+            return True
+        return self._clock() - record.get("generated_at", 0) < self.max_age
+
+    def fresh_records(self, mbti):
+        return [r for r in self._by_mbti.get(mbti, []) if self.is_fresh(r)]
+
+    def lookup(self, mbti, user_prompt=None):
+        """新鮮な処方があれば1件（複数あればランダム）返す。無ければ None"""
+        candidates = [
+            r for r in self.fresh_records(mbti)
+            if user_prompt is None or r.get("user_prompt") == user_prompt
+        ]
+        if not candidates:
+            return None
+        return random.choice(candidates)
+
+    def stale_types(self, mbti_types, expected_prompts=None):
+        """新鮮な処方を持たない MBTI タイプの一覧。
+
+        app はカタログで選んだ本のプロンプトで引くので、expected_prompts（{mbti: [user_prompt, ...]}）を
+        渡すと、そのうち1つでも新鮮な処方が無いタイプを古いとみなす。
+        """
+        if expected_prompts is None:
+            return [m for m in mbti_types if self.lookup(m) is None]
+        return [m for m in mbti_types if any(self.lookup(m, p) is None for p in expected_prompts[m])]
+
+    def __len__(self):
+        return sum(len(v) for v in self._by_mbti.values())
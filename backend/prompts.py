@@ -0,0 +1,63 @@
+"""Shadow Book 処方のプロンプト定義。
+
+Streamlit アプリ（app.py）とバッチ処理（warmup.py）で同じプロンプトを使うため、ここにまとめる。
+"""
+
+import re
+
+TEMPERATURE = 0.7
+# 本がカタログから選ばれているときは解説だけなので短く切る
+EXPLAIN_MAX_TOKENS = 600
+
+# --- システムプロンプト ---
+SYSTEM_PROMPT = """
+あなたは「熟練の選書カウンセラー（Book Therapist）」です。
+ユーザーのMBTI（性格）と真逆の性質を持つ本（Shadow Book）を提案し、
+なぜその本がユーザーの「影」を補い、成長させるのかを解説してください。
+本が指定されている場合は、その本についての解説だけを簡潔に書いてください。
+"""
+
+# --- データ定義: MBTIとShadow ---
+mbti_shadow_map = {
+    "INTJ": "ESFP", "INTP": "ESFJ", "ENTJ": "ISFP", "ENTP": "ISFJ",
+    "INFJ": "ESTP", "INFP": "ESTJ", "ENFJ": "ISTP", "ENFP": "ISTJ",
+    "ISTJ": "ENFP", "ISFJ": "ENTP", "ESTJ": "INFP", "ESFJ": "INTP",
+    "ISTP": "ENFJ", "ISFP": "ENTJ", "ESTP": "INFJ", "ESFP": "INTJ"
+}
+
+_WIDE_CHARS = re.compile(r"[　-ヿ㐀-鿿豈-﫿＀-￯]")
+
+
+def estimate_tokens(text):
+    """トークン数の概算。日本語は1文字≒1トークン、それ以外は4文字≒1トークンで数える"""
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def build_user_prompt(mbti, book=None):
+    """book（book_catalog.Book）を渡すと、その本の解説だけを頼むプロンプトにする"""
+    shadow_mbti = mbti_shadow_map[mbti]
+    if book is not None:
+        return f"私のMBTIは{mbti}です。{shadow_mbti}的な視点を得る本として『{book.title}』（{book.author}）を解説してください。"
+    return f"私のMBTIは{mbti}です。真逆の{shadow_mbti}的な視点を得られる本を1冊紹介してください。"
+
+
+def build_worry_prompt(mbti, worry):
+    """自由入力の悩みに対して、Shadow の視点から本を選んでもらうプロンプト"""
+    shadow_mbti = mbti_shadow_map[mbti]
+    return f"私のMBTIは{mbti}です。今「{worry}」という悩みを抱えています。{shadow_mbti}的な視点からこの悩みに効く本を1冊紹介してください。"
+
+
+def completion_options(book=None):
+    """chat.completions.create に渡す生成パラメータ"""
+    options = {"temperature": TEMPERATURE}
+    if book is not None:
+        options["max_tokens"] = EXPLAIN_MAX_TOKENS
+    return options
+
+
+def build_messages(user_prompt):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
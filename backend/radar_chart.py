@@ -0,0 +1,72 @@
+"""診断の4軸スコアから作るレーダーチャート。
+
+各軸の両極（感情⇔論理 など）を1本ずつのスポークにして、
+「現在のあなた」と「読書後の拡張（Shadow 側の極を足したもの）」を重ねて描く。
+Figure はスコアの組ごとにプロセス内でメモ化するので、フィードやサイドバーの操作で
+再実行されても Plotly の組み立てと検証はやり直さない。
+"""
+
+from functools import lru_cache
+
+from book_catalog import axes_from_mbti
+from master_data import AXES, POLES
+
+# 対になる極が向かい合うように並べる
+POLE_ORDER = ("emotional", "tempo", "abstract", "action", "logical", "story", "concrete", "reflection")
+POLE_LABELS = {
+    "emotional": "感情",
+    "tempo": "テンポ",
+    "abstract": "抽象",
+    "action": "行動",
+    "logical": "論理",
+    "story": "物語",
+    "concrete": "具体",
+    "reflection": "内省",
+}
+
+# 極の強さ 0〜1 を 1〜4 の目盛りに載せる（範囲は 0〜5）
+BASE = 1.0
+SPAN = 3.0
+# 読書で Shadow 側の極がどのくらい伸びるか
+READING_GAIN = 0.6
+
+_AXIS_INDEX = {axis: i for i, axis in enumerate(AXES)}
+
+
+def pole_scores(profile, gain=1.0):
+    """AXES 順の軸プロフィール（-1〜1）を POLE_ORDER 順の目盛りに変換する"""
+    scores = []
+    for pole in POLE_ORDER:
+        axis, sign = POLES[pole]
+        strength = max(0.0, min(1.0, sign * float(profile[_AXIS_INDEX[axis]])))
+        # キャッシュのキーになるので丸めておく
+        scores.append(round(BASE + SPAN * gain * strength, 2))
+    return tuple(scores)
+
+
+def radar_scores(profile, shadow_profile):
+    """(現在, 読書後) の目盛りを返す。読書後は Shadow 側の極を足したもの"""
+    current = pole_scores(profile)
+    shadow = pole_scores(shadow_profile, gain=READING_GAIN)
+    return current, tuple(max(c, s) for c, s in zip(current, shadow))
+
+
+def radar_scores_for_mbti(mbti, shadow_mbti, profile=None):
+    """診断プロフィールが無ければ MBTI から軸を推定する"""
+    if profile is None:
+        profile = axes_from_mbti(mbti)
+    return radar_scores(profile, axes_from_mbti(shadow_mbti))
+
+
+@lru_cache(maxsize=256)
+def radar_figure(current, expanded):
+    """目盛りの組から Figure を作る。呼び出し側で書き換えないこと"""
+    # plotly は import が重いので、チャートを初めて描くときに読み込む
+    import plotly.graph_objects as go
+
+    categories = [POLE_LABELS[pole] for pole in POLE_ORDER]
+    fig = go.Figure()
+    fig.add_trace(go.Scatterpolar(r=list(current), theta=categories, fill='toself', name='現在のあなた'))
+    fig.add_trace(go.Scatterpolar(r=list(expanded), theta=categories, fill='toself', name='読書後の拡張', line_color='pink'))
+    fig.update_layout(polar=dict(radialaxis=dict(visible=True, range=[0, 5])), showlegend=True, height=300)
+    return fig
@@ -0,0 +1,352 @@
+"""Groq 呼び出しのレート制限と利用量の記録（同じホストのワーカープロセス間で共有）。
+
+- 1分あたりのリクエスト数（RPM）とトークン数（TPM）をトークンバケットで制限する。
+  バケットは SQLite に置くので、複数の Streamlit ワーカープロセスで同じ枠を分け合う。
+- 枠が空くのを待つリクエストは、ユーザーごとに順番を回す（1人が大量に投げても他の人が先に通る）。
+- Groq の usage から日ごとの利用量と概算費用を台帳に積み、日次の上限を超えたら新しい呼び出しを断る。
+  台帳は RPM / TPM の制限を設定していなくても付ける（rpm=tpm=None なら待たずに通す）。
+
+TPM は送信前に「プロンプトの概算 + max_tokens」を仮押さえし、応答の usage で差額を精算する。
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from prompts import estimate_tokens
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ratelimit.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS waiters (
+    ticket INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS served (
+    user TEXT PRIMARY KEY,
+    served_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ledger (
+    day TEXT NOT NULL,
+    user TEXT NOT NULL,
+    model TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, user, model)
+);
+"""
+
+# ユーザーごとの順番（何番目の待ちか）→ 最後に通った時刻が古いユーザー → 受付順 で並べた先頭が次に通る
+_HEAD = """
+SELECT w.ticket FROM (
+    SELECT ticket, user, ROW_NUMBER() OVER (PARTITION BY user ORDER BY ticket) AS turn FROM waiters
+) AS w LEFT JOIN served AS s ON s.user = w.user
+ORDER BY w.turn, COALESCE(s.served_at, 0), w.ticket LIMIT 1
+"""
+
+# 1M トークンあたりの USD（入力, 出力）。MODEL_PRICES（JSON）で上書き・追加できる
+DEFAULT_PRICES = {
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+    "llama-3.1-8b-instant": (0.05, 0.08),
+    "openai/gpt-oss-120b": (0.15, 0.75),
+}
+# max_tokens の指定が無いときに仮押さえする出力トークン数
+DEFAULT_COMPLETION_RESERVE = 512
+# 待ちの確認間隔と、応答の無い待ち（落ちたプロセス）を捨てるまでの秒数
+POLL_INTERVAL = 0.05
+STALE_WAITER = 10.0
+
+
+class RateLimitTimeout(Exception):
+    """待ち時間の上限までに枠が空かなかった"""
+
+    def __init__(self, waited):
+        super().__init__(f"混み合っています。{waited:.0f}秒待ちましたが順番が回ってきませんでした")
+        self.waited = waited
+
+
+class QuotaExceeded(Exception):
+    """今日の利用額が上限に達している"""
+
+    def __init__(self, spent, limit):
+        super().__init__(f"本日の AI 利用上限（${limit:.2f}）に達しました。明日またお試しください")
+        self.spent = spent
+        self.limit = limit
+
+
+class Reservation:
+    __slots__ = ("user", "tokens")
+
+    def __init__(self, user, tokens):
+        self.user = user
+        self.tokens = tokens
+
+
+def estimate_request_tokens(kwargs):
+    """chat.completions.create の引数から、仮押さえするトークン数を見積もる"""
+    prompt = sum(estimate_tokens(str(m.get("content", ""))) + 4 for m in kwargs.get("messages", ()))
+    completion = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or DEFAULT_COMPLETION_RESERVE
+    return prompt + completion
+
+
+def _usage_value(usage, name):
+    value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+    return int(value or 0)
+
+
+def db_path():
+    return os.getenv("RATE_LIMIT_DB", DEFAULT_PATH)
+
+
+class RateLimiter:
+    """SQLite 上のトークンバケット（RPM / TPM）と日次台帳。プロセス・スレッドをまたいで使える。
+
+    rpm と tpm がどちらも None ならバケットは使わず、台帳（と日次の上限）だけを扱う。
+    """
+
+    def __init__(self, path=None, rpm=30, tpm=6000, daily_limit=None, prices=None, wait_timeout=60.0,
+                 clock=time.time):
+        self.path = path or db_path()
+        self.limited = rpm is not None or tpm is not None
+        # 片方だけ指定されたら、もう片方は実質無制限にする
+        self.rpm = rpm if rpm is not None else 1_000_000
+        self.tpm = tpm if tpm is not None else 1_000_000_000
+        self.daily_limit = daily_limit
+        self.prices = dict(DEFAULT_PRICES, **(prices or {}))
+        self.wait_timeout = wait_timeout
+        self._clock = clock
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    # --- バケット ---
+    def _refill(self, conn, name, capacity, now):
+        row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return float(capacity)
+        tokens, updated_at = row
+        return min(float(capacity), tokens + max(0.0, now - updated_at) * capacity / 60.0)
+
+    def _store(self, conn, name, tokens, now):
+        conn.execute(
+            "INSERT INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+            (name, tokens, now),
+        )
+
+    def _take(self, conn, tokens, now):
+        """両方のバケットから取れれば取って 0 を、足りなければ空くまでの秒数を返す"""
+        if not self.limited:
+            return 0.0
+        # 1回で TPM の容量を超える見積もりは容量で頭打ちにする（永久に通らなくなるのを防ぐ）
+        tokens = min(tokens, self.tpm)
+        requests_left = self._refill(conn, "rpm", self.rpm, now)
+        tokens_left = self._refill(conn, "tpm", self.tpm, now)
+        if requests_left >= 1 and tokens_left >= tokens:
+            self._store(conn, "rpm", requests_left - 1, now)
+            self._store(conn, "tpm", tokens_left - tokens, now)
+            return 0.0
+        wait_requests = max(0.0, 1 - requests_left) * 60.0 / self.rpm
+        wait_tokens = max(0.0, tokens - tokens_left) * 60.0 / self.tpm
+        return max(wait_requests, wait_tokens, POLL_INTERVAL)
+
+    # --- 日次の上限 ---
+    def _today(self, now):
+        return datetime.datetime.fromtimestamp(now).strftime("%Y-%m-%d")
+
+    def _spent_today(self, conn, now):
+        row = conn.execute("SELECT COALESCE(SUM(cost), 0) FROM ledger WHERE day = ?", (self._today(now),)).fetchone()
+        return row[0]
+
+    # --- 取得 ---
+    def _try_acquire(self, user, tokens, ticket):
+        """1回だけ試す。(取れたか, 待ち時間, 待ち札) を返す"""
+        now = self._clock()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM waiters WHERE heartbeat < ?", (now - STALE_WAITER,))
+            conn.execute("DELETE FROM served WHERE served_at < ?", (now - 60.0,))
+            if self.daily_limit is not None:
+                spent = self._spent_today(conn, now)
+                if spent >= self.daily_limit:
+                    if ticket is not None:
+                        conn.execute("DELETE FROM waiters WHERE ticket = ?", (ticket,))
+                    conn.execute("COMMIT")
+                    raise QuotaExceeded(spent, self.daily_limit)
+            head = conn.execute(_HEAD).fetchone()
+            if ticket is not None:
+                conn.execute("UPDATE waiters SET heartbeat = ? WHERE ticket = ?", (now, ticket))
+            # 待っている人がいれば割り込まず、ユーザーごとの順番が回ってきたときだけ取りに行く
+            if head is None or (ticket is not None and head[0] == ticket):
+                wait = self._take(conn, tokens, now)
+                if not wait:
+                    if ticket is not None:
+                        conn.execute("DELETE FROM waiters WHERE ticket = ?", (ticket,))
+                    conn.execute(
+                        "INSERT INTO served (user, served_at) VALUES (?, ?) "
+                        "ON CONFLICT(user) DO UPDATE SET served_at = excluded.served_at",
+                        (user, now),
+                    )
+                    conn.execute("COMMIT")
+                    return True, 0.0, None
+            else:
+                wait = POLL_INTERVAL
+            if ticket is None:
+                ticket = conn.execute("INSERT INTO waiters (user, heartbeat) VALUES (?, ?)", (user, now)).lastrowid
+            conn.execute("COMMIT")
+        except QuotaExceeded:
+            raise
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return False, wait, ticket
+
+    def _leave(self, ticket):
+        if ticket is None:
+            return
+        conn = self._connect()
+        conn.execute("DELETE FROM waiters WHERE ticket = ?", (ticket,))
+
+    def acquire(self, user, tokens, timeout=None):
+        """枠が空くまで待って Reservation を返す。timeout 秒を超えたら RateLimitTimeout"""
+        if not self.limited and self.daily_limit is None:
+            return Reservation(user, tokens)
+        timeout = self.wait_timeout if timeout is None else timeout
+        started = time.monotonic()
+        ticket = None
+        try:
+            while True:
+                ok, wait, ticket = self._try_acquire(user, tokens, ticket)
+                if ok:
+                    ticket = None
+                    return Reservation(user, tokens)
+                elapsed = time.monotonic() - started
+                if elapsed + min(wait, POLL_INTERVAL) > timeout:
+                    raise RateLimitTimeout(elapsed)
+                # 先頭でなくても、前の人が通ったらすぐ気づけるよう短い間隔で確認する
+                time.sleep(min(wait, POLL_INTERVAL * 4))
+        finally:
+            self._leave(ticket)
+
+    async def aacquire(self, user, tokens, timeout=None):
+        """acquire の asyncio 版。SQLite の操作はスレッドで行い、イベントループを止めない"""
+        if not self.limited and self.daily_limit is None:
+            return Reservation(user, tokens)
+        timeout = self.wait_timeout if timeout is None else timeout
+        started = time.monotonic()
+        ticket = None
+        try:
+            while True:
+                ok, wait, ticket = await asyncio.to_thread(self._try_acquire, user, tokens, ticket)
+                if ok:
+                    ticket = None
+                    return Reservation(user, tokens)
+                elapsed = time.monotonic() - started
+                if elapsed + min(wait, POLL_INTERVAL) > timeout:
+                    raise RateLimitTimeout(elapsed)
+                await asyncio.sleep(min(wait, POLL_INTERVAL * 4))
+        finally:
+            if ticket is not None:
+                await asyncio.to_thread(self._leave, ticket)
+
+    # --- 精算と台帳 ---
+    def cost(self, model, prompt_tokens, completion_tokens):
+        price_in, price_out = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+
+    def settle(self, reservation, model, usage):
+        """応答の usage で仮押さえとの差額をバケットに戻し（または追加で引き）、台帳に記録する"""
+        prompt_tokens = _usage_value(usage, "prompt_tokens") if usage is not None else 0
+        completion_tokens = _usage_value(usage, "completion_tokens") if usage is not None else 0
+        now = self._clock()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if usage is not None and self.limited:
+                actual = prompt_tokens + completion_tokens
+                tokens = self._refill(conn, "tpm", self.tpm, now)
+                # 使い過ぎた分はマイナスにして、次の呼び出しを待たせる
+                self._store(conn, "tpm", min(float(self.tpm), tokens + min(reservation.tokens, self.tpm) - actual), now)
+            conn.execute(
+                "INSERT INTO ledger (day, user, model, requests, prompt_tokens, completion_tokens, cost) "
+                "VALUES (?, ?, ?, 1, ?, ?, ?) "
+                "ON CONFLICT(day, user, model) DO UPDATE SET requests = requests + 1, "
+                "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                "completion_tokens = completion_tokens + excluded.completion_tokens, "
+                "cost = cost + excluded.cost",
+                (self._today(now), reservation.user, model, prompt_tokens, completion_tokens,
+                 self.cost(model, prompt_tokens, completion_tokens)),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self, reservation):
+        """生成されなかった呼び出しの仮押さえを TPM に戻す（RPM は上流でも数えられているので戻さない）"""
+        if not self.limited:
+            return
+        now = self._clock()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tokens = self._refill(conn, "tpm", self.tpm, now)
+            self._store(conn, "tpm", min(float(self.tpm), tokens + min(reservation.tokens, self.tpm)), now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def daily_usage(self, day=None):
+        """[{day, user, model, requests, prompt_tokens, completion_tokens, cost}, ...]"""
+        day = day or self._today(self._clock())
+        rows = self._connect().execute(
+            "SELECT day, user, model, requests, prompt_tokens, completion_tokens, cost FROM ledger "
+            "WHERE day = ? ORDER BY cost DESC", (day,)
+        ).fetchall()
+        keys = ("day", "user", "model", "requests", "prompt_tokens", "completion_tokens", "cost")
+        return [dict(zip(keys, row)) for row in rows]
+
+
+def limiter_from_env():
+    """環境変数から RateLimiter を作る。
+
+    RATE_LIMIT_RPM / RATE_LIMIT_TPM が未設定なら待たずに通し、利用量の台帳だけを付ける。
+    USAGE_LEDGER=0 で制限も無ければ None（何もしない）。
+    """
+    rpm = os.getenv("RATE_LIMIT_RPM")
+    tpm = os.getenv("RATE_LIMIT_TPM")
+    daily = os.getenv("DAILY_SPEND_LIMIT_USD")
+    if not rpm and not tpm and not daily and os.getenv("USAGE_LEDGER", "1") == "0":
+        return None
+    prices = {model: tuple(price) for model, price in json.loads(os.getenv("MODEL_PRICES", "{}")).items()}
+    return RateLimiter(
+        rpm=float(rpm) if rpm else None,
+        tpm=float(tpm) if tpm else None,
+        daily_limit=float(daily) if daily else None,
+        prices=prices,
+        wait_timeout=float(os.getenv("RATE_LIMIT_WAIT", "60")),
+    )
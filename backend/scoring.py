@@ -0,0 +1,110 @@
+"""diagnostic_questions の採点エンジン。
+
+master_data でコンパイル済みの質問を一度だけ NumPy の「選択肢 × 軸」行列にコンパイルし、
+1人分の回答でも数千人分の回答でも、行列の gather と sum だけで軸ごとの合計を出す。
+"""
+
+import numpy as np
+
+from master_data import AXES, get_master_data
+
+UNANSWERED = -1
+
+
+class ScoringEngine:
+    def __init__(self, questions):
+        self.axes = AXES
+        self.question_ids = tuple(q.id for q in questions)
+        self._question_index = {qid: i for i, qid in enumerate(self.question_ids)}
+        # 質問ごとの 選択肢キー → 列番号
+        self._choice_index = []
+        offsets = []
+        rows = []
+        for q in questions:
+            offsets.append(len(rows))
+            keys = {}
+            for choice in q.choices:
+                keys[choice.key] = len(keys)
+                rows.append(choice.scores)
+            self._choice_index.append(keys)
+        # 末尾の 0 行は「未回答」用
+        rows.append([0] * len(self.axes))
+        self.matrix = np.asarray(rows, dtype=np.int32)
+        self.matrix.setflags(write=False)
+        self._offsets = np.asarray(offsets, dtype=np.intp)
+        self._n_choices = np.asarray([len(k) for k in self._choice_index], dtype=np.intp)
+        self._blank_row = len(rows) - 1
+
+        # 軸ごとの最大到達点（各質問で最も振れ幅の大きい選択肢の絶対値の合計）
+        max_abs = np.zeros(len(self.axes), dtype=np.float64)
+        for i, offset in enumerate(offsets):
+            n_choices = len(self._choice_index[i])
+            max_abs += np.abs(self.matrix[offset:offset + n_choices]).max(axis=0)
+        # 一度も採点されない軸で 0 除算しないようにする
+        self._scale = np.where(max_abs > 0, max_abs, 1.0)
+
+    @property
+    def n_questions(self):
+        return len(self.question_ids)
+
+    def encode(self, answers):
+        """{質問ID: 選択肢キー} を選択肢番号の配列に変換する（未回答は -1）"""
+        encoded = np.full(self.n_questions, UNANSWERED, dtype=np.intp)
+        for qid, key in answers.items():
+            try:
+                q = self._question_index[qid]
+            except KeyError:
+                raise ValueError(f"unknown question id: {qid!r}") from None
+            try:
+                encoded[q] = self._choice_index[q][key]
+            except KeyError:
+                raise ValueError(f"unknown choice {key!r} for question {qid}") from None
+        return encoded
+
+    def encode_batch(self, sheets):
+        """回答シートのリストを (人数, 質問数) の配列に変換する"""
+        if not sheets:
+            return np.empty((0, self.n_questions), dtype=np.intp)
+        return np.stack([self.encode(sheet) for sheet in sheets])
+
+    def totals(self, encoded):
+        """(人数, 質問数) の選択肢番号から (人数, 軸数) の合計点を求める"""
+        encoded = np.asarray(encoded, dtype=np.intp)
+        if encoded.ndim != 2 or encoded.shape[1] != self.n_questions:
+            raise ValueError(f"expected shape (n, {self.n_questions}), got {encoded.shape}")
+        if ((encoded < UNANSWERED) | (encoded >= self._n_choices)).any():
+            raise ValueError("choice index out of range")
+        rows = np.where(encoded == UNANSWERED, self._blank_row, self._offsets + encoded)
+        return self.matrix[rows].sum(axis=1)
+
+    def profile(self, totals):
+        """合計点を軸ごとに -1.0〜1.0 へ正規化する"""
+        return np.asarray(totals, dtype=np.float64) / self._scale
+
+    def score_batch(self, sheets):
+        """回答シート（辞書のリスト、または encode 済み配列）をまとめて採点し (totals, profile) を返す"""
+        if isinstance(sheets, np.ndarray):
+            encoded = sheets
+        else:
+            encoded = self.encode_batch(list(sheets))
+        totals = self.totals(encoded)
+        return totals, self.profile(totals)
+
+    def score(self, answers):
+        """1人分の回答を採点して {"totals": {...}, "profile": {...}} を返す"""
+        totals, profile = self.score_batch(self.encode(answers)[np.newaxis, :])
+        return {
+            "totals": dict(zip(self.axes, totals[0].tolist())),
+            "profile": dict(zip(self.axes, profile[0].tolist())),
+        }
+
+
+_engine = None
+
+
+def get_engine():
+    """マスターデータの質問からコンパイルした共有エンジン"""
+    global _engine
+    if _engine is None:
+        _engine = ScoringEngine(get_master_data().questions)
+    return _engine
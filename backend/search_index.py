@@ -0,0 +1,122 @@
+"""悩みシナリオとみんなの処方箋を横断するキーワード検索。
+
+日本語は単語区切りが無いので、正規化した文字列を文字 bi-gram に分割して転置インデックスを作る。
+ランキングは BM25。投稿は追加されるたびにインデックスへ差分で入れる。
+"""
+
+import heapq
+import math
+import re
+import threading
+import unicodedata
+
+_SEPARATORS = re.compile(r"[\s、。，．・,.!?！？「」『』（）()\[\]【】…/]+")
+
+
+def normalize(text):
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def tokenize(text, n=2):
+    """文字 n-gram の列を返す。n 文字未満の断片はそのまま1トークンにする"""
+    tokens = []
+    for chunk in _SEPARATORS.split(normalize(text)):
+        if not chunk:
+            continue
+        if len(chunk) < n:
+            tokens.append(chunk)
+            continue
+        tokens.extend(chunk[i:i + n] for i in range(len(chunk) - n + 1))
+    return tokens
+
+
+class SearchIndex:
+    """BM25 でランキングする転置インデックス（スレッドセーフ）"""
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}  # gram -> {文書番号: 出現回数}
+        self._keys = []  # 文書番号 -> (種別, ID)
+        self._payloads = []
+        self._lengths = []
+        self._key_index = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def add(self, kind, doc_id, text, payload=None):
+        """文書を追加する。同じ (種別, ID) が既にあれば何もしない"""
+        key = (kind, doc_id)
+        tokens = tokenize(text)
+        with self._lock:
+            if key in self._key_index:
+                return
+            doc = len(self._keys)
+            self._key_index[key] = doc
+            self._keys.append(key)
+            self._payloads.append(payload)
+            self._lengths.append(len(tokens))
+            self._total_length += len(tokens)
+            for gram in tokens:
+                postings = self._postings.setdefault(gram, {})
+                postings[doc] = postings.get(doc, 0) + 1
+
+    def search(self, query, limit=10, kind=None):
+        """[(スコア, 種別, ID, payload), ...] をスコアの高い順に返す"""
+        grams = set(tokenize(query))
+        if not grams:
+            return []
+        with self._lock:
+            n_docs = len(self._keys)
+            if not n_docs:
+                return []
+            avg_length = self._total_length / n_docs
+            scores = {}
+            for gram in grams:
+                postings = self._postings.get(gram)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc] / avg_length)
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            if kind is not None:
+                scores = {doc: s for doc, s in scores.items() if self._keys[doc][0] == kind}
+            top = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+            return [(score, *self._keys[doc], self._payloads[doc]) for doc, score in top]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._keys)
+
+
+class CommunitySearch:
+    """悩みシナリオ＋投稿の検索。投稿は CommunityStore から差分で取り込む"""
+
+    def __init__(self, scenarios, community_store):
+        self.index = SearchIndex()
+        self.community_store = community_store
+        self._last_post_id = 0
+        self._sync_lock = threading.Lock()
+        for w in scenarios:
+            self.index.add("scenario", w.id, f"{w.button_text} {' '.join(w.search_keywords)}", w)
+        self.sync()
+
+    def add_post(self, post):
+        self.index.add("post", post.id, f"{post.title} {post.symptom} {post.effect}", post)
+
+    def sync(self, batch=500):
+        """前回以降に投稿された分（他のプロセスの投稿も含む）を取り込む"""
+        with self._sync_lock:
+            while True:
+                posts = self.community_store.posts_after(self._last_post_id, limit=batch)
+                for post in posts:
+                    self.add_post(post)
+                if posts:
+                    self._last_post_id = posts[-1].id
+                if len(posts) < batch:
+                    break
+
+    def search(self, query, limit=10, kind=None):
+        self.sync()
+        return self.index.search(query, limit=limit, kind=kind)
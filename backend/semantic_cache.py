@@ -0,0 +1,192 @@
+"""言い回しが違うだけの相談に過去の回答を使い回すための意味的キャッシュ。
+
+相談文を文字 n-gram のハッシュベクトルに埋め込み、同じ名前空間
+（モデル・温度・MBTI など、回答を共有してよい範囲）の中でコサイン類似度が
+閾値以上の過去の回答を返す。ベクトルは固定サイズの行列に置き、TTL と LRU で入れ替える。
+「楽しい」と「楽しくない」のように否定の有無だけが違う相談はベクトルが近いので、
+否定の向き（極性）が違う回答は類似度に関係なく返さない。
+
+    python semantic_cache.py     # 使い回してはいけない・使い回したい相談の組を確かめる
+"""
+
+import re
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from search_index import normalize, tokenize
+
+DEFAULT_DIM = 1024
+# 漢字・カタカナ・英数字の連なり（内容語）。助詞や活用語尾のひらがなは言い回しで変わりやすい
+_CONTENT_RUN = re.compile(r"[一-鿿々〆ヵヶァ-ヺーa-z0-9]+")
+# ひらがなしか無い相談（「つらい」など）も拾えるよう、全文の bi-gram も弱めに入れる
+SURFACE_WEIGHT = 0.3
+# 否定の助動詞・形容詞（ない・なく・なかっ・ません・ずに など）。二重否定は肯定に戻る
+_NEGATION = re.compile(r"な(?:い|く|かっ|けれ|きゃ)|ません|無[いく]|ず[にもと]")
+# 回答を使い回してはいけない組と、使い回したい組（python semantic_cache.py で確かめる）
+CHECK_DIFFERENT = [
+    ("仕事が楽しくない", "仕事が楽しい"),
+    ("別れたい", "別れたくない"),
+    ("眠れない", "眠れる"),
+    ("会社に行きたくありません", "会社に行きたいです"),
+]
+CHECK_SAME = [
+    ("仕事が楽しくない", "仕事が楽しくないです"),
+    ("恋人と別れたい", "恋人と別れたいです"),
+]
+
+
+def embed(text, dim=DEFAULT_DIM):
+    """相談文を L2 正規化したハッシュベクトルにする（プロセスをまたいでも同じ値になる）"""
+    vector = np.zeros(dim, dtype=np.float32)
+
+    def add(gram, weight):
+        vector[zlib.crc32(gram.encode("utf-8")) % dim] += weight
+
+    for run in _CONTENT_RUN.findall(normalize(text)):
+        for i, char in enumerate(run):
+            add(char, 1.0)
+            if i + 1 < len(run):
+                add(run[i:i + 2], 1.0)
+    for gram in tokenize(text):
+        add(gram, SURFACE_WEIGHT)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def negation_polarity(text):
+    """否定の数の偶奇（0=肯定、1=否定）"""
+    return len(_NEGATION.findall(normalize(text))) % 2
+
+
+class SemanticCache:
+    """類似度検索付きの回答キャッシュ（スレッドセーフ）"""
+
+    def __init__(self, max_entries=512, threshold=0.88, ttl_seconds=24 * 60 * 60, dim=DEFAULT_DIM,
+                 clock=time.monotonic):
+        if max_entries < 1:
+            raise ValueError("max_entries must be >= 1")
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("threshold must be in (0, 1]")
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.dim = dim
+        self._clock = clock
+        # 行ごとに1件。namespace が -1 の行は空き
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._namespaces = np.full(max_entries, -1, dtype=np.int32)
+        self._polarities = np.zeros(max_entries, dtype=np.int8)
+        self._stored_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._answers = [None] * max_entries
+        self._namespace_ids = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _live_rows(self, namespace_id, polarity, now):
+        rows = (self._namespaces == namespace_id) & (self._polarities == polarity)
+        if self.ttl_seconds is not None:
+            rows &= now - self._stored_at < self.ttl_seconds
+        return rows
+
+    def _best(self, namespace_id, vector, polarity, now):
+        """否定の向きが同じ行から (行, 類似度) を返す。候補が無ければ (None, 0.0)"""
+        rows = np.flatnonzero(self._live_rows(namespace_id, polarity, now))
+        if not rows.size:
+            return None, 0.0
+        similarities = self._vectors[rows] @ vector
+        best = int(similarities.argmax())
+        return int(rows[best]), float(similarities[best])
+
+    def get(self, namespace, text):
+        """閾値以上に似た相談の回答を (回答, 類似度) で返す。無ければ None"""
+        vector = embed(text, self.dim)
+        polarity = negation_polarity(text)
+        now = self._clock()
+        with self._lock:
+            namespace_id = self._namespace_ids.get(namespace)
+            row, similarity = (None, 0.0) if namespace_id is None else self._best(namespace_id, vector, polarity, now)
+            if row is None or similarity < self.threshold:
+                self.misses += 1
+                return None
+            self._last_used[row] = now
+            self.hits += 1
+            return self._answers[row], similarity
+
+    def _free_row(self, now):
+        empty = np.flatnonzero(self._namespaces < 0)
+        if empty.size:
+            return int(empty[0])
+        if self.ttl_seconds is not None:
+            expired = np.flatnonzero(now - self._stored_at >= self.ttl_seconds)
+            if expired.size:
+                return int(expired[0])
+        # 空きも期限切れも無ければ、最も長く使われていない行を追い出す
+        self.evictions += 1
+        return int(self._last_used.argmin())
+
+    def put(self, namespace, text, answer):
+        """回答を登録する。ほぼ同じ相談（類似度 0.99 以上）が既にあれば置き換える"""
+        vector = embed(text, self.dim)
+        polarity = negation_polarity(text)
+        now = self._clock()
+        with self._lock:
+            namespace_id = self._namespace_ids.setdefault(namespace, len(self._namespace_ids))
+            row, similarity = self._best(namespace_id, vector, polarity, now)
+            if row is None or similarity < 0.99:
+                row = self._free_row(now)
+            self._vectors[row] = vector
+            self._namespaces[row] = namespace_id
+            self._polarities[row] = polarity
+            self._stored_at[row] = now
+            self._last_used[row] = now
+            self._answers[row] = answer
+
+    def clear(self):
+        with self._lock:
+            self._namespaces[:] = -1
+            self._answers = [None] * self.max_entries
+            self._namespace_ids.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": int((self._namespaces >= 0).sum()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return int((self._namespaces >= 0).sum())
+
+
+def check(threshold=0.88):
+    """CHECK_DIFFERENT が使い回されず、CHECK_SAME が使い回されることを確かめ、失敗の説明を返す"""
+    failures = []
+    for expect_hit, pairs in ((False, CHECK_DIFFERENT), (True, CHECK_SAME)):
+        for stored, asked in pairs:
+            cache = SemanticCache(max_entries=4, threshold=threshold)
+            cache.put("check", stored, stored)
+            hit = cache.get("check", asked)
+            similarity = float(embed(stored) @ embed(asked))
+            print(f"{'hit ' if hit else 'miss'} {similarity:.3f}  {stored} / {asked}")
+            if (hit is not None) != expect_hit:
+                failures.append(f"{stored} / {asked}: expected {'hit' if expect_hit else 'miss'}")
+    return failures
+
+
+if __name__ == "__main__":
+    failures = check()
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,167 @@
+"""コールドスタートの計測と予算チェック。
+
+app.py からは load_env() と計測用の begin() / mark() / finish() を使う。
+STARTUP_PROFILE=1 のときだけ、プロセスで最初のスクリプト実行について
+フェーズごとの経過時間（最初の描画完了まで）を標準エラーに出す。
+
+コマンドラインからは、新しいインタープリターで app.py を初回実行し、
+import の内訳と初回描画までの時間を出す。予算を超えたら終了コード 1 を返す:
+
+    python startup.py                      # 内訳を表示
+    python startup.py --budget-ms 2500     # STARTUP_BUDGET_MS でも指定できる
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(BACKEND_DIR, "app.py")
+
+
+
+def load_env():
+    """.env があるときだけ python-dotenv を読み込む（コンテナでは環境変数だけで足りる）。
+
+    load_dotenv() の既定（find_dotenv）と同じく、backend から親ディレクトリへ順に探す。
+    """
+    directory = BACKEND_DIR
+    while True:
+        path = os.path.join(directory, ".env")
+        if os.path.isfile(path):
+            from dotenv import load_dotenv
+
+            load_dotenv(path)
+            return path
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def profiling():
+    # import 時ではなく呼ぶたびに読む（.env の STARTUP_PROFILE は load_env の後で入る）
+    return os.getenv("STARTUP_PROFILE", "0") == "1"
+
+
+# --- アプリ内の計測 ---
+_run = None
+_reported = False
+
+
+def begin():
+    """スクリプト実行の先頭で呼ぶ"""
+    global _run
+    if profiling() and not _reported:
+        _run = [("start", time.perf_counter())]
+
+
+def mark(phase):
+    if _run is not None:
+        _run.append((phase, time.perf_counter()))
+
+
+def finish():
+    """スクリプト実行の末尾で呼ぶ。プロセスで最初の1回だけ内訳を出す"""
+    global _run, _reported
+    if _run is None:
+        return
+    mark("first_paint")
+    start = _run[0][1]
+    parts = [f"{phase} {(t - start) * 1000:.0f} ms" for phase, t in _run[1:]]
+    print("startup: " + " / ".join(parts), file=sys.stderr)
+    _run = None
+    _reported = True
+
+
+# --- コマンドライン ---
+# 初回実行だけを測る小さなドライバー。import の内訳は -X importtime で標準エラーに出る
+_DRIVER = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+framework = time.perf_counter()
+at = AppTest.from_file(sys.argv[1], default_timeout=float(sys.argv[2]))
+at.run()
+done = time.perf_counter()
+print(json.dumps({
+    "framework_ms": (framework - start) * 1000,
+    "first_run_ms": (done - framework) * 1000,
+    "exceptions": [e.value for e in at.exception],
+}))
+"""
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+
+def parse_importtime(stderr):
+    """-X importtime の出力から、直接 import されたモジュールの [(累積 µs, 名前), ...] を返す"""
+    rows = []
+    for line in stderr.splitlines():
+        m = _IMPORTTIME.match(line)
+        # インデントが 1 つ（先頭の空白だけ）のものが、直接 import されたモジュール
+        if m and len(m.group(3)) == 1:
+            rows.append((int(m.group(2)), m.group(4)))
+    return sorted(rows, reverse=True)
+
+
+def measure_cold_start(app_path=APP_PATH, timeout=60.0):
+    """新しいインタープリターで app.py を1回実行し、計測結果を dict で返す"""
+    workdir = tempfile.mkdtemp(prefix="shadow-startup-")
+    env = dict(os.environ)
+    # 計測中に本物の Groq や手元の DB に触らないようにする
+    env.update({
+        "GROQ_API_KEY": env.get("GROQ_API_KEY") or "startup-check",
+        "GROQ_BASE_URL": "http://127.0.0.1:9",
+        "COMMUNITY_DB": os.path.join(workdir, "community.db"),
+        "USER_DB": os.path.join(workdir, "users.db"),
+        "RATE_LIMIT_DB": os.path.join(workdir, "ratelimit.db"),
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _DRIVER, app_path, str(timeout)],
+        cwd=os.path.dirname(app_path), env=env, capture_output=True, text=True, timeout=timeout * 2,
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"cold start run failed:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["process_ms"] = wall_ms
+    result["imports"] = parse_importtime(proc.stderr)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="app.py のコールドスタート時間を計測する")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "0")) or None,
+                        help="初回描画までの予算（ミリ秒）。超えたら終了コード 1")
+    parser.add_argument("--top", type=int, default=15, help="表示する import の数")
+    parser.add_argument("--runs", type=int, default=1, help="計測回数（最小値で判定する）")
+    args = parser.parse_args(argv)
+
+    results = [measure_cold_start() for _ in range(max(1, args.runs))]
+    best = min(results, key=lambda r: r["first_run_ms"])
+    print(f"{'module':<40}{'cumulative ms':>15}")
+    for cumulative_us, name in best["imports"][:args.top]:
+        print(f"{name:<40}{cumulative_us / 1000:>15.1f}")
+    print()
+    print(f"framework import: {best['framework_ms']:.0f} ms")
+    print(f"first paint (app.py first run): {best['first_run_ms']:.0f} ms")
+    print(f"process total: {best['process_ms']:.0f} ms")
+    if best["exceptions"]:
+        print("app raised: " + "; ".join(best["exceptions"]), file=sys.stderr)
+        return 1
+    if args.budget_ms is not None and best["first_run_ms"] > args.budget_ms:
+        print(f"FAIL first paint {best['first_run_ms']:.0f} ms > budget {args.budget_ms:.0f} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
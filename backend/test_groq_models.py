@@ -1,45 +1,33 @@
 import os
-from dotenv import load_dotenv
-from groq import Groq
+import sys
+from startup import load_env
+from groq_client import get_client
+from model_router import ModelRouter, candidates_from_env
 
-load_dotenv()
+load_env()
 
 API_KEY = os.environ.get("GROQ_API_KEY")
 if not API_KEY:
     print("GROQ_API_KEY not set in environment or .env")
     exit(1)
 
-client = Groq(api_key=API_KEY)
+classes = candidates_from_env()
+# Extra model names on the command line are probed alongside the configured candidates
+if len(sys.argv) > 1:
+    classes["cli"] = sys.argv[1:]
 
-candidates = [
-    "llama3-70b-8192",
-    "llama3-70b",
-    "llama3-70b-instruct",
-    "llama3-70b-v2",
-    "llama3-13b",
-    "llama3-13b-instruct",
-    "llama3-70b-2048",
-]
+router = ModelRouter(get_client(), classes)
 
-system = {"role": "system", "content": "あなたはテスト用の簡易アシスタントです。短く挨拶してください。"}
-user = {"role": "user", "content": "こんにちは"}
+# All candidates are probed in parallel
+results = router.probe()
 
-for model in candidates:
-    try:
-        print(f"\nTrying model: {model}")
-        completion = client.chat.completions.create(
-            model=model,
-            messages=[system, user],
-            temperature=0.0,
-            max_tokens=50,
-        )
-        # Access response depending on client
-        try:
-            text = completion.choices[0].message.content
-        except Exception:
-            # fallback: whole object
-            text = str(completion)
-        print("SUCCESS:\n", text)
-        break
-    except Exception as e:
-        print("ERROR:", e)
+for model, ok, error in sorted(results, key=lambda r: r[0]):
+    health = next(h for h in router.snapshot() if h["model"] == model)
+    if ok:
+        print(f"OK    {model:<45} {health['latency_ms']:8.0f} ms")
+    else:
+        print(f"ERROR {model:<45} {error}")
+
+print()
+for request_class in classes:
+    print(f"{request_class}: {' > '.join(router.rank(request_class)) or '(no healthy model)'}")
@@ -0,0 +1,233 @@
+"""ユーザー登録・ログインの永続ストア（SQLite）。
+
+パスワードはソルト付き scrypt（コストは環境変数で調整）で保存する。
+ハッシュ計算はログイン時だけに行い、以降の再実行ではセッショントークンを
+プロセス内 LRU から引くだけにする。ログイン失敗はユーザー名ごとに回数制限する。
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from prompts import mbti_shadow_map
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "users.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password_hash TEXT NOT NULL,
+    mbti TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+# デモ用アカウント（ユーザーが1人もいないときだけ作る）
+DEFAULT_USERS = [
+    ("testuser", "testpass", "INFP"),
+]
+
+
+class LoginRateLimited(Exception):
+    """ログイン失敗が続いたため一時的にロックされている"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"ログインの試行回数が多すぎます。{retry_after:.0f}秒後に再度お試しください")
+        self.retry_after = retry_after
+
+
+def db_path():
+    return os.getenv("USER_DB", DEFAULT_PATH)
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def hash_password(password, n=None, r=8, p=1):
+    """scrypt$n$r$p$salt$hash 形式の文字列を返す"""
+    n = n or int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 14)))
+    salt = secrets.token_bytes(16)
+    digest = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=256 * 1024 * 1024, dklen=32)
+    return f"scrypt${n}${r}${p}${_b64(salt)}${_b64(digest)}"
+
+
+def verify_password(password, encoded):
+    try:
+        algorithm, n, r, p, salt, expected = encoded.split("$")
+    except ValueError:
+        return False
+    if algorithm != "scrypt":
+        return False
+    digest = hashlib.scrypt(
+        password.encode("utf-8"),
+        salt=base64.b64decode(salt),
+        n=int(n), r=int(r), p=int(p),
+        maxmem=256 * 1024 * 1024,
+        dklen=32,
+    )
+    return hmac.compare_digest(digest, base64.b64decode(expected))
+
+
+class LoginLimiter:
+    """ユーザー名ごとに window 秒あたり max_failures 回まで失敗を許す。
+
+    失敗の記録は最後に失敗した順に並べ、期限切れのものは記録のたびに先頭から捨てる。
+    それでも max_keys を超えたら最も前に失敗したユーザー名から忘れる。
+    """
+
+    def __init__(self, max_failures=5, window=300.0, max_keys=10000, clock=time.monotonic):
+        self.max_failures = max_failures
+        self.window = window
+        self.max_keys = max_keys
+        self._clock = clock
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        now = self._clock()
+        with self._lock:
+            attempts = self._failures.get(key)
+            if not attempts:
+                return
+            while attempts and now - attempts[0] >= self.window:
+                attempts.popleft()
+            if not attempts:
+                del self._failures[key]
+            elif len(attempts) >= self.max_failures:
+                raise LoginRateLimited(self.window - (now - attempts[0]))
+
+    def record_failure(self, key):
+        now = self._clock()
+        with self._lock:
+            attempts = self._failures.setdefault(key, deque())
+            attempts.append(now)
+            self._failures.move_to_end(key)
+            # 先頭ほど最後の失敗が古い。最後の失敗が期限切れなら全部期限切れ
+            while self._failures:
+                oldest = next(iter(self._failures.values()))
+                if now - oldest[-1] < self.window and len(self._failures) <= self.max_keys:
+                    break
+                self._failures.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._failures)
+
+
+class SessionCache:
+    """セッショントークン → ユーザー情報 の LRU（TTL 付き）"""
+
+    def __init__(self, max_sessions=10000, ttl=12 * 60 * 60, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._clock = clock
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, token, user):
+        with self._lock:
+            self._sessions[token] = (self._clock(), user)
+            self._sessions.move_to_end(token)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def get(self, token):
+        with self._lock:
+            item = self._sessions.get(token)
+            if item is None:
+                return None
+            created, user = item
+            if self._clock() - created >= self.ttl:
+                del self._sessions[token]
+                return None
+            self._sessions.move_to_end(token)
+            return user
+
+    def revoke(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+
+class UserStore:
+    def __init__(self, path=None, limiter=None, sessions=None):
+        self.path = path or db_path()
+        self.limiter = limiter or LoginLimiter()
+        self.sessions = sessions or SessionCache()
+        self._local = threading.local()
+        # 存在しないユーザーでも同じ時間をかけて照合する（ユーザー名の推測対策）
+        self._dummy_hash = hash_password(secrets.token_urlsafe(16))
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+        return conn
+
+    def seed_if_empty(self, users=DEFAULT_USERS):
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is not None:
+            return
+        for username, password, mbti in users:
+            try:
+                self.register(username, password, mbti)
+            except ValueError:
+                pass
+
+    def register(self, username, password, mbti):
+        """新規登録。入力不備や重複は ValueError"""
+        if not username or not password:
+            raise ValueError("ユーザー名とパスワードを入力してください")
+        if mbti not in mbti_shadow_map:
+            raise ValueError(f"不明なMBTIタイプです: {mbti!r}")
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO users (username, password_hash, mbti, created_at) VALUES (?, ?, ?, ?)",
+                    (username, hash_password(password), mbti, time.time()),
+                )
+        except sqlite3.IntegrityError:
+            raise ValueError("このユーザー名は既に使われています") from None
+
+    def authenticate(self, username, password):
+        """照合に成功したらセッショントークンを返し、失敗したら None。
+
+        失敗が続いたユーザー名には LoginRateLimited を送出する。
+        """
+        self.limiter.check(username)
+        row = self._connect().execute(
+            "SELECT password_hash, mbti FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        encoded = row[0] if row else self._dummy_hash
+        if not verify_password(password, encoded) or row is None:
+            self.limiter.record_failure(username)
+            return None
+        self.limiter.reset(username)
+        token = secrets.token_urlsafe(32)
+        self.sessions.put(token, {"username": username, "mbti": row[1]})
+        return token
+
+    def session_user(self, token):
+        """トークンからユーザー情報を引く（ハッシュ計算なし）。期限切れなら None"""
+        if not token:
+            return None
+        return self.sessions.get(token)
+
+    def logout(self, token):
+        self.sessions.revoke(token)
@@ -0,0 +1,121 @@
+"""全 MBTI タイプ分の Shadow Book 処方を事前生成して保存する。
+
+デプロイ時や cron から実行する:
+
+    python warmup.py                  # 古い・未生成のタイプだけ生成
+    python warmup.py --force          # 全タイプを作り直す
+    python warmup.py --variants 3 --concurrency 4 --rpm 30
+"""
+
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from startup import load_env
+
+from book_catalog import shadow_books
+from model_router import get_router
+from prescription_store import PrescriptionStore, store_path, system_hash, write_store
+from prompts import SYSTEM_PROMPT, TEMPERATURE, build_messages, build_user_prompt, completion_options, mbti_shadow_map
+
+
+class Pacer:
+    """スレッド間で共有する送信間隔（requests per minute）の制御"""
+
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def expected_books(mbti):
+    """app が処方しうる本（カタログが無ければ None 1件＝本選びから LLM に任せるプロンプト）"""
+    return shadow_books(mbti) or [None]
+
+
+def generate(router, pacer, mbti, book):
+    user_prompt = build_user_prompt(mbti, book)
+    pacer.wait()
+    completion, model = router.complete(
+        "prescription",
+        messages=build_messages(user_prompt),
+        **completion_options(book),
+    )
+    return {
+        "mbti": mbti,
+        "shadow_type": mbti_shadow_map[mbti],
+        "model": model,
+        "system_hash": system_hash(SYSTEM_PROMPT),
+        "user_prompt": user_prompt,
+        "temperature": TEMPERATURE,
+        "book_id": book.id if book else None,
+        "content": completion.choices[0].message.content,
+        "generated_at": time.time(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shadow Book 処方を全 MBTI タイプ分事前生成する")
+    parser.add_argument("--output", default=None, help="保存先（既定: PRESCRIPTION_STORE または backend/prescriptions.jsonl）")
+    parser.add_argument("--variants", type=int, default=1, help="タイプ・候補の本ごとに生成する処方の数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時リクエスト数")
+    parser.add_argument("--rpm", type=float, default=30, help="1分あたりの最大リクエスト数（0 で無制限）")
+    parser.add_argument("--force", action="store_true", help="新鮮な処方があっても作り直す")
+    args = parser.parse_args(argv)
+
+    load_env()
+    path = args.output or store_path()
+    existing = PrescriptionStore.load(path, system_prompt=SYSTEM_PROMPT)
+    books = {m: expected_books(m) for m in mbti_shadow_map}
+    prompts = {m: [build_user_prompt(m, book) for book in books[m]] for m in mbti_shadow_map}
+    types = list(mbti_shadow_map) if args.force else existing.stale_types(mbti_shadow_map, prompts)
+    # 作り直さないタイプの処方は、今も処方しうる本のものだけ残す
+    kept = [] if args.force else [
+        r for m in mbti_shadow_map if m not in types for r in existing.fresh_records(m)
+        if r.get("user_prompt") in prompts[m]
+    ]
+    if not types:
+        print(f"All {len(mbti_shadow_map)} types are fresh in {path}")
+        return 0
+
+    router = get_router(probe=False)
+    router.probe()
+    pacer = Pacer(args.rpm)
+    records = []
+    failures = 0
+    jobs = [(m, book) for m in types for book in books[m] for _ in range(args.variants)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = {pool.submit(generate, router, pacer, mbti, book): mbti for mbti, book in jobs}
+        for future in as_completed(futures):
+            mbti = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"ERROR {mbti}: {e}", file=sys.stderr)
+                continue
+            records.append(record)
+            print(f"OK    {mbti} ({record['model']})")
+
+    records.sort(key=lambda r: r["mbti"])
+    write_store(kept + records, path)
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {len(kept) + len(records)} prescriptions to {path} in {elapsed:.1f}s ({failures} failed)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())